@@ -13,10 +13,77 @@ import uvicorn
 from dotenv import load_dotenv
 from fastapi.responses import RedirectResponse
 from middleware.apiLogger import log_requests, read_request_log, read_db_count
+from cache.db_cache import db_cache
+from contextlib import asynccontextmanager
+from config.schema import sync_schema
+from controllers.timeline_controller import trim_timelines, backfill_timelines
+from controllers.user_stats_controller import reconcile_user_stats
+from services.hashtag_index import hashtag_index
+from services.trending import trending_hashtags
+from services.like_buffer import like_buffer
+from services.like_index import like_index
+import asyncio
 
 load_dotenv()
 
-app = FastAPI()
+# seconds between trimming the home timelines back to their cap
+TIMELINE_TRIM_INTERVAL = float(os.getenv("TIMELINE_TRIM_INTERVAL", "300"))
+# seconds between recounting the follower/following counters
+USER_STATS_RECONCILE_INTERVAL = float(os.getenv("USER_STATS_RECONCILE_INTERVAL", "3600"))
+# seconds between reloading the hashtag autocomplete index, picks up hashtags created by other API instances
+HASHTAG_INDEX_REFRESH_INTERVAL = float(os.getenv("HASHTAG_INDEX_REFRESH_INTERVAL", "300"))
+
+def run_job(job):
+    """run a maintenance job (a function taking a session) on its own session"""
+    db = deploy.SessionLocal()
+    try:
+        return job(db)
+    finally:
+        db.close()
+
+async def run_periodically(job, interval):
+    """run a maintenance job now and then every interval seconds, in a thread so requests aren't blocked"""
+    while True:
+        try:
+            await asyncio.to_thread(run_job, job)
+        except Exception as e:
+            print(f"{job.__name__} failed: {e}")
+        await asyncio.sleep(interval)
+
+async def run_once(job):
+    """run a maintenance job once, in a thread so requests aren't blocked"""
+    try:
+        await asyncio.to_thread(run_job, job)
+    except Exception as e:
+        print(f"{job.__name__} failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """runs once when the API starts, and again (after the yield) when it stops"""
+    # create tables/indexes that were added to the models since the database was set up
+    sync_schema(deploy.engine)
+    jobs = [
+        asyncio.create_task(run_periodically(trim_timelines, TIMELINE_TRIM_INTERVAL)),
+        # the first run also fills the counters of users created before the counters existed
+        asyncio.create_task(run_periodically(reconcile_user_stats, USER_STATS_RECONCILE_INTERVAL)),
+        # the first run loads the hashtag autocomplete index
+        asyncio.create_task(run_periodically(hashtag_index.load, HASHTAG_INDEX_REFRESH_INTERVAL)),
+        # fills the timelines from the follows that existed before home_timeline did, once
+        asyncio.create_task(run_once(backfill_timelines)),
+    ]
+    # replay the last day of hashtags so trending isn't empty after a restart
+    try:
+        await asyncio.to_thread(run_job, trending_hashtags.load)
+    except Exception as e:
+        print(f"Loading trending hashtags failed: {e}")
+    like_buffer.start()
+    yield
+    for job in jobs:
+        job.cancel()
+    # write the likes that are still in memory before the process exits
+    like_buffer.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # register the HTTP‐logging middleware
 app.middleware("http")(log_requests)
@@ -33,6 +100,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods (GET, POST, etc.)
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["Link", "X-Next-Cursor"],  # pagination cursor for the frontend
 )
 
 # Include the router - this is like app.use("/api/users", userRoutes) in Express
@@ -49,7 +117,9 @@ async def root():
 async def get_logs():
     return {
         "requests": read_request_log(),
-        "db_access_count": read_db_count()
+        "db_access_count": read_db_count(),
+        "db_cache": db_cache.stats(),
+        "like_index": like_index.stats()
     }
 
 if __name__ == "__main__":
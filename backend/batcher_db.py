@@ -1,7 +1,7 @@
 import os
 import time
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, Integer, Float
+from sqlalchemy import create_engine, event, Column, Integer, Float, String
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -14,6 +14,19 @@ connect_args = {"check_same_thread": False} if BATCH_DATABASE_URL.startswith("sq
 
 # create an engine for connecting to the cache database
 engine_cache = create_engine(BATCH_DATABASE_URL, connect_args=connect_args)
+# optional: WAL journal + synchronous=NORMAL, a commit no longer waits for a full disk sync and
+# the worker can read the queue while the API writes to it. A power loss can lose the last
+# commits (never corrupt the file), so it is off unless LIKE_CACHE_WAL=true
+LIKE_CACHE_WAL = os.getenv("LIKE_CACHE_WAL", "false").lower() == "true"
+
+if LIKE_CACHE_WAL and BATCH_DATABASE_URL.startswith("sqlite"):
+    @event.listens_for(engine_cache, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
 # create a sessionmaker for generating new session objects
 SessionCache = sessionmaker(bind=engine_cache, autoflush=False, expire_on_commit=False)
 # create a base class for defining our ORM models in the cache database
@@ -26,7 +39,17 @@ class LikeCache(BaseCache):
     count = Column(Integer, default=0, nullable=False)
     firstSeenAt = Column(Float, default=time.time, nullable=False)
 
-# create the like_cache table if it does not already exist
+# likes the worker has claimed from like_cache but not finished moving to the main database.
+# A claim moves rows here under a new batch_id in one transaction, so likes that arrive
+# afterwards start a new like_cache row instead of changing a batch that is being applied.
+# A batch is deleted once the main database has it, whatever is left after a crash is retried
+class LikeOutbox(BaseCache):
+    __tablename__ = "like_outbox"
+    batch_id = Column(String(32), primary_key=True)
+    tweetId = Column(Integer, primary_key=True, index=True)
+    count = Column(Integer, nullable=False)
+
+# create the like_cache and like_outbox tables if they do not already exist
 # this runs automatically when this module is imported
 BaseCache.metadata.create_all(bind=engine_cache)
 
@@ -0,0 +1,34 @@
+from sqlalchemy import inspect, text
+from config.db import Base
+from config.search_index import setup_search_index
+# no API module uses the worker's batch log, imported so its table is created with the others
+import models.like_flush_schema  # noqa: F401
+
+def sync_schema(engine):
+    """
+    Create the tables and indexes the models declare but the database doesn't have yet.
+
+    Base.metadata.create_all() only creates missing tables, an index or a column that was
+    added to a model later (e.g. ix_tweets_created_at_id, likes.user_id) is never created for
+    a table that already exists, so those are added here one by one. Only nullable columns
+    are added, the existing rows have no value for them.
+    The full-text index over tweets is database specific and set up by setup_search_index.
+    Runs once when the API starts.
+    """
+    Base.metadata.create_all(bind=engine)
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns and column.nullable:
+                column_type = column.type.compile(dialect=engine.dialect)
+                with engine.begin() as connection:
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+
+    setup_search_index(engine)
@@ -0,0 +1,54 @@
+from sqlalchemy import text
+
+# full-text index over tweets.content, the DDL depends on the database:
+# - Postgres: a generated tsvector column with a GIN index, kept in sync by Postgres itself
+# - SQLite (local/test runs): an FTS5 table over tweets, kept in sync by triggers
+# other databases get no index and search falls back to ILIKE (see search_controller)
+
+POSTGRES_SEARCH_DDL = [
+    """
+    ALTER TABLE tweets ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_tweets_search_vector ON tweets USING GIN (search_vector)",
+]
+
+SQLITE_SEARCH_DDL = [
+    # external content table: the index points at tweets rows instead of keeping a copy of the text
+    "CREATE VIRTUAL TABLE IF NOT EXISTS tweets_fts USING fts5(content, content='tweets', content_rowid='id')",
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_fts_insert AFTER INSERT ON tweets BEGIN
+        INSERT INTO tweets_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_fts_delete AFTER DELETE ON tweets BEGIN
+        INSERT INTO tweets_fts (tweets_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_fts_update AFTER UPDATE OF content ON tweets BEGIN
+        INSERT INTO tweets_fts (tweets_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO tweets_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+]
+
+def setup_search_index(engine):
+    """
+    Create the full-text index if it doesn't exist yet, called by sync_schema when the API starts.
+    Existing tweets are indexed too (Postgres fills the generated column, SQLite gets a rebuild)
+    """
+    dialect = engine.dialect.name
+    with engine.begin() as connection:
+        if dialect == "postgresql":
+            for statement in POSTGRES_SEARCH_DDL:
+                connection.execute(text(statement))
+        elif dialect == "sqlite":
+            exists = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tweets_fts'")
+            ).first()
+            for statement in SQLITE_SEARCH_DDL:
+                connection.execute(text(statement))
+            if not exists:
+                connection.execute(text("INSERT INTO tweets_fts (tweets_fts) VALUES ('rebuild')"))
@@ -1,49 +1,56 @@
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, aliased
 from models.user_schema import User
 from models.follow_schema import Follow
-from cache.db_cache import get_from_cache, save_to_cache
+from cache.db_cache import cached, invalidate
+from controllers.pagination import DEFAULT_PAGE_SIZE, encode_cursor, keyset_page
+from controllers.user_stats_controller import get_user_stats, update_follow_counts
+from controllers.timeline_controller import backfill_timeline, remove_author_from_timeline
+
+def follows_page(query, before: str = None):
+    """
+    newest follows first, starting right after the 'before' cursor if given.
+    Keyset pagination on (created_at, id) like the tweet lists
+    """
+    return keyset_page(query, Follow.created_at, Follow.id, before)
+
+def user_exists(db: Session, user_id: int):
+    if db.query(User.id).filter(User.id == user_id).first() is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"User with ID {user_id} not found"
+        )
 
 # @desc Get users that a specific user is following
-# @route GET /users/following
-def get_user_following(user_id: int, db: Session):
+# @route GET /users/following?before={created_at,id}&limit={n}
+@cached("user_following_{user_id}_{before}_{limit}", tags=["following:{user_id}"])
+def get_user_following(user_id: int, db: Session, before: str = None, limit: int = DEFAULT_PAGE_SIZE):
     """
-    Get all users that a specific user is following
+    Get one page of the users that a specific user is following, most recently followed first
     
     :param user_id: ID of the user whose following list to retrieve
     :param db: SQLAlchemy database session
-    :return: List of users the specified user is following with follow status
+    :param before: cursor of the last follow of the previous page, None for the first page
+    :param limit: number of users in the page
+    :return: total count, the users of this page with follow status and the cursor of the next page
     :raises HTTPException: If user not found
     """
-  # Use user ID in the cache key
-    cache_key = f"user_following_{user_id}"
-    cached_result = get_from_cache(cache_key)
-    
-    if cached_result is not None:
-        print(f"DB Cache HIT: {cache_key}")
-        return cached_result
-    
-    print(f"DB Cache MISS: {cache_key}")
-    # Not in cache, get from database
-    
+
     # check if the user exists
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"User with ID {user_id} not found"
-        )
+    user_exists(db, user_id)
     
-    # get all users the current user follows
-    following = db.query(User).join(
+    # one page of the users the current user follows, plus one row to know if there is a next page
+    query = db.query(User, Follow.created_at, Follow.id).join(
         Follow, Follow.following_id == User.id
     ).filter(
         Follow.follower_id == user_id
-    ).all()
+    )
+    rows = follows_page(query, before).limit(limit + 1).all()
+    page = rows[:limit]
     
     # format the response
     following_list = []
-    for followed_user in following:
+    for followed_user, _, _ in page:
         following_list.append({
             "id": followed_user.id,
             "username": followed_user.username,
@@ -53,76 +60,77 @@ def get_user_following(user_id: int, db: Session):
         })
     
     result = {
-        "count": len(following_list),
-        "following": following_list
+        "count": get_user_stats(db, user_id)["following"],
+        "following": following_list,
+        "next_cursor": encode_cursor(page[-1][1], page[-1][2]) if len(rows) > limit else None
     }
-    
-    # Save to cache
-    save_to_cache(cache_key, result)
-    
+
     return result
 
+# @desc Which of the given users a user follows
+# @route GET /users/following/status?ids={id},{id},...
+def get_following_status(user_id: int, user_ids: list, db: Session):
+    """
+    {"following": [the ids in user_ids that user_id follows]}, for follow buttons.
+    One lookup on the unique (follower_id, following_id) index, however many follows the user has,
+    where scanning the paginated following list would only see its first page
+    """
+    if not user_ids:
+        return {"following": []}
+    rows = db.query(Follow.following_id).filter(
+        Follow.follower_id == user_id,
+        Follow.following_id.in_(user_ids)
+    ).all()
+    return {"following": [row[0] for row in rows]}
+
 # Get users following a specific user
-def get_user_followers(user_id: int, db: Session):
+# @route GET /users/followers?before={created_at,id}&limit={n}
+@cached("user_followers_{user_id}_{before}_{limit}", tags=["followers:{user_id}", "following:{user_id}"])
+def get_user_followers(user_id: int, db: Session, before: str = None, limit: int = DEFAULT_PAGE_SIZE):
     """
-    Get all followers of a specific user
+    Get one page of the followers of a specific user, most recent followers first
     
     :param user_id: ID of the user whose followers to retrieve
     :param db: SQLAlchemy database session
-    :return: List of users following the specified user
+    :param before: cursor of the last follow of the previous page, None for the first page
+    :param limit: number of users in the page
+    :return: total count, the followers of this page and the cursor of the next page
     :raises HTTPException: If user not found
     """
-    cache_key = f"user_followers_{user_id}"
-    cached_result = get_from_cache(cache_key)
-    
-    if cached_result is not None:
-        print(f"DB Cache HIT: {cache_key}")
-        return cached_result
-    
-    print(f"DB Cache MISS: {cache_key}")
-    # Not in cache, get from database
-    
+
     # Check if user exists
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"User with ID {user_id} not found"
-        )
+    user_exists(db, user_id)
     
-    # Get all users who follow this user
-    followers = db.query(User).join(
+    # Get the followers, and in the same query whether the user follows each of them back:
+    # a LEFT JOIN on the follow in the other direction, its id is NULL when there is none
+    follow_back = aliased(Follow)
+    query = db.query(User, Follow.created_at, Follow.id, follow_back.id).join(
         Follow, Follow.follower_id == User.id
+    ).outerjoin(
+        follow_back,
+        (follow_back.follower_id == user_id) & (follow_back.following_id == User.id)
     ).filter(
         Follow.following_id == user_id
-    ).all()
+    )
+    rows = follows_page(query, before).limit(limit + 1).all()
+    page = rows[:limit]
     
-    # Check which of these followers are also being followed by the user
     followers_list = []
-    
-    for follower in followers:
-        # Check if user follows this user back
-        is_following = db.query(Follow).filter(
-            Follow.follower_id == user_id,
-            Follow.following_id == follower.id
-        ).first() is not None
-        
+    for follower, _, _, follow_back_id in page:
         followers_list.append({
             "id": follower.id,
             "username": follower.username,
             "display_name": follower.display_name,
             "bio": follower.bio,
-            "is_following": is_following
+            "is_following": follow_back_id is not None
         })
     
     result = {
-        "count": len(followers_list),
-        "followers": followers_list
+        "count": get_user_stats(db, user_id)["followers"],
+        "followers": followers_list,
+        "next_cursor": encode_cursor(page[-1][1], page[-1][2]) if len(rows) > limit else None
     }
-    
-    # Save to cache
-    save_to_cache(cache_key, result)
-    
+
     return result
 
 # @desc Follow a user
@@ -171,7 +179,11 @@ def follow_user(current_user_id: int, user_to_follow_id: int, db: Session):
     )
     
     db.add(new_follow)
+    # their recent tweets show up in the home timeline right away
+    backfill_timeline(db, current_user_id, user_to_follow_id)
+    update_follow_counts(db, current_user_id, user_to_follow_id, 1)
     db.commit()
+    invalidate(f"following:{current_user_id}", f"followers:{user_to_follow_id}")
     
     return {
         "success": True,
@@ -212,13 +224,17 @@ def unfollow_user(current_user_id: int, user_to_unfollow_id: int, db: Session):
     
     # Remove the follow relationship
     db.delete(follow)
+    remove_author_from_timeline(db, current_user_id, user_to_unfollow_id)
+    update_follow_counts(db, current_user_id, user_to_unfollow_id, -1)
     db.commit()
+    invalidate(f"following:{current_user_id}", f"followers:{user_to_unfollow_id}")
     
     return {
         "success": True,
         "message": f"You have unfollowed {user_to_unfollow.username}"
     }
 
+@cached("followers_count_{user_id}", tags=["followers:{user_id}"])
 def get_followers_count(user_id: int, db: Session):
     """
     Count the number of followers for a specific user
@@ -227,35 +243,19 @@ def get_followers_count(user_id: int, db: Session):
     :param db: SQLAlchemy database session
     :return: Count of followers
     """
-    cache_key = f"followers_count_{user_id}"
-    cached_result = get_from_cache(cache_key)
-    
-    if cached_result is not None:
-        print(f"DB Cache HIT: {cache_key}")
-        return cached_result
-    
-    print(f"DB Cache MISS: {cache_key}")
-    # Not in cache, count from database
-    count = db.query(Follow).filter(Follow.following_id == user_id).count()
-    result = {"count": count}
-    
-    # Save to cache
-    save_to_cache(cache_key, result)
-    
+    result = {"count": get_user_stats(db, user_id)["followers"]}
+
     return result
 
+@cached("following_count_{user_id}", tags=["following:{user_id}"])
 def get_following_count(user_id: int, db: Session):
-    cache_key = f"followers_count_{user_id}"
-    cached_result = get_from_cache(cache_key)
-    
-    if cached_result is not None:
-        print(f"DB Cache HIT: {cache_key}")
-        return cached_result
-    
-    print(f"DB Cache MISS: {cache_key}")
-    count = db.query(Follow).filter(Follow.following_id == user_id).count()
-    result = {"count": count}
-    
-    save_to_cache(cache_key, result)
+    """
+    Count the number of users a specific user is following
     
-    return result
\ No newline at end of file
+    :param user_id: ID of the user whose follows to count
+    :param db: SQLAlchemy database session
+    :return: Count of followed users
+    """
+    result = {"count": get_user_stats(db, user_id)["following"]}
+
+    return result
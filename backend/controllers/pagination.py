@@ -0,0 +1,63 @@
+from datetime import datetime
+from urllib.parse import quote
+from fastapi import HTTPException, Response, status
+from sqlalchemy import func, tuple_
+
+# page sizes for cursor-paginated lists
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """
+    Cursor pointing right after a row in a newest-first list, "<created_at>,<id>".
+    The id breaks ties between rows created in the same instant
+    """
+    return f"{created_at.isoformat()},{row_id}"
+
+def decode_cursor(cursor: str):
+    """
+    Reverse of encode_cursor, returns (created_at, id)
+
+    :raises HTTPException: 400 if the cursor is malformed
+    """
+    try:
+        created_at, row_id = cursor.rsplit(",", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor, expected '<created_at>,<id>'"
+        )
+
+# SQLite stores timestamps as text, "YYYY-MM-DD HH:MM:SS" when written by func.now() but
+# "YYYY-MM-DD HH:MM:SS.ffffff" when bound from Python, and compares them as strings, so a cursor
+# bound as a datetime sorts after every row of its own second. On SQLite both sides are brought
+# to one format (millisecond precision) before comparing and ordering
+SQLITE_TIMESTAMP = "%Y-%m-%d %H:%M:%f"
+
+def keyset_page(query, created_at_column, id_column, before: str = None):
+    """
+    query ordered newest first on (created_at, id), starting right after the 'before' cursor if given.
+    Keyset pagination: an index on (created_at, id) jumps straight to the cursor,
+    unlike OFFSET which has to walk over every row before the page
+    """
+    sqlite = query.session.get_bind().dialect.name == "sqlite"
+    if sqlite:
+        created_at_column = func.strftime(SQLITE_TIMESTAMP, created_at_column)
+    if before:
+        created_at, row_id = decode_cursor(before)
+        if sqlite:
+            created_at = created_at.strftime("%Y-%m-%d %H:%M:%S.") + f"{created_at.microsecond // 1000:03d}"
+        query = query.filter(tuple_(created_at_column, id_column) < tuple_(created_at, row_id))
+    return query.order_by(created_at_column.desc(), id_column.desc())
+
+def set_next_cursor(response: Response, path: str, next_cursor: str, limit: int):
+    """
+    Point the client at the next page with the X-Next-Cursor and Link headers,
+    so list endpoints can keep returning a plain list as the body
+    """
+    if next_cursor:
+        # path may already carry query parameters (e.g. the search query)
+        separator = "&" if "?" in path else "?"
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{path}{separator}before={quote(next_cursor)}&limit={limit}>; rel="next"'
@@ -0,0 +1,112 @@
+import re
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+from sqlalchemy import func, literal, literal_column, table, column
+from models.tweet_schema import Tweet
+from cache.db_cache import cached
+from controllers.pagination import DEFAULT_PAGE_SIZE
+from controllers.tweet_queries import tweet_to_dict, with_like_counts, with_liked_by_me
+
+# matched words are wrapped in these in the "highlight" field
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+
+def encode_rank_cursor(rank: float, tweet_id: int) -> str:
+    """Cursor pointing right after a search result, "<rank>,<id>". repr() keeps the float exact"""
+    return f"{rank!r},{tweet_id}"
+
+def decode_rank_cursor(cursor: str):
+    try:
+        rank, tweet_id = cursor.rsplit(",", 1)
+        return float(rank), int(tweet_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor, expected '<rank>,<id>'"
+        )
+
+def postgres_search(db: Session, query: str):
+    """(tweets query, rank, highlight) using the tsvector column and its GIN index"""
+    search_vector = literal_column("tweets.search_vector")
+    # websearch_to_tsquery accepts whatever a user types ("quoted phrases", -excluded, or)
+    ts_query = func.websearch_to_tsquery("english", query)
+    rank = func.ts_rank_cd(search_vector, ts_query)
+    highlight = func.ts_headline(
+        "english", Tweet.content, ts_query,
+        f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, HighlightAll=true"
+    )
+    rows = db.query(Tweet, rank.label("rank"), highlight.label("highlight")).filter(search_vector.op("@@")(ts_query))
+    return rows, rank
+
+def sqlite_search(db: Session, query: str):
+    """(tweets query, rank, highlight) using the FTS5 table, the local/test stand-in for Postgres"""
+    # every word quoted, so characters that mean something in the FTS5 syntax can't break the query
+    fts_query = " ".join(f'"{word}"' for word in re.findall(r"\w+", query))
+    tweets_fts = table("tweets_fts", column("rowid"))
+    fts = literal_column("tweets_fts")
+    # bm25() is lower for better matches, negated so a higher rank is better on both databases
+    rank = -func.bm25(fts)
+    highlight = func.highlight(fts, 0, HIGHLIGHT_START, HIGHLIGHT_END)
+    rows = (
+        db.query(Tweet, rank.label("rank"), highlight.label("highlight"))
+        .join(tweets_fts, tweets_fts.c.rowid == Tweet.id)
+        .filter(fts.op("MATCH")(fts_query))
+    )
+    return rows, rank
+
+def fallback_search(db: Session, query: str):
+    """ILIKE scan for databases without a full-text index, every match has the same rank"""
+    rank = literal(0.0)
+    rows = db.query(Tweet, rank.label("rank"), Tweet.content.label("highlight")).filter(Tweet.content.ilike(f"%{query}%"))
+    return rows, rank
+
+SEARCH_BACKENDS = {
+    "postgresql": postgres_search,
+    "sqlite": sqlite_search,
+}
+
+@cached("search_tweets_{query}_{before}_{limit}", tags=["tweets"])
+def find_tweets(db: Session, query: str, before: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    """
+    :param query: the search string
+    :param before: cursor of the last result of the previous page, None for the first page
+    :param limit: number of tweets in the page
+    :return: {"tweets": [...], "next_cursor": cursor for the next page or None on the last page}
+             every tweet has a "rank" (higher is better) and a "highlight" with the matched words
+             wrapped in <mark></mark>; the content is not HTML-escaped, escape it before rendering
+    """
+    if not re.search(r"\w", query):
+        return {"tweets": [], "next_cursor": None}
+
+    backend = SEARCH_BACKENDS.get(db.get_bind().dialect.name, fallback_search)
+    rows, rank = backend(db, query)
+
+    if before:
+        last_rank, last_id = decode_rank_cursor(before)
+        rows = rows.filter((rank < last_rank) | ((rank == last_rank) & (Tweet.id < last_id)))
+
+    # fetch one extra row to know if there is a next page
+    results = rows.order_by(rank.desc(), Tweet.id.desc()).limit(limit + 1).all()
+    page = results[:limit]
+
+    tweets = []
+    for tweet, tweet_rank, highlight in page:
+        data = tweet_to_dict(tweet)
+        data["rank"] = tweet_rank
+        data["highlight"] = highlight
+        tweets.append(data)
+
+    next_cursor = None
+    if len(results) > limit:
+        last_tweet, last_rank, _ = page[-1]
+        next_cursor = encode_rank_cursor(last_rank, last_tweet.id)
+
+    return {"tweets": tweets, "next_cursor": next_cursor}
+
+# search for tweets that contain the words of the query, best matches first
+# route GET /tweets/search?query={query}&before={rank,id}&limit={n}
+def search_tweets(db: Session, query: str, before: str = None, limit: int = DEFAULT_PAGE_SIZE, viewer_id: int = None):
+    """cached results of find_tweets with their current like counts, and "liked_by_me" for viewer_id"""
+    page = find_tweets(db, query, before, limit)
+    tweets = with_liked_by_me(db, viewer_id, with_like_counts(db, page["tweets"]))
+    return {"tweets": tweets, "next_cursor": page["next_cursor"]}
@@ -0,0 +1,192 @@
+import os
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import func, insert, select, exists, literal
+from models.tweet_schema import Tweet
+from models.follow_schema import Follow
+from models.timeline_schema import HomeTimeline
+from models.user_stats_schema import UserStats
+from cache.db_cache import cached
+from controllers.pagination import DEFAULT_PAGE_SIZE, encode_cursor, keyset_page
+from controllers.tweet_queries import tweet_to_dict, with_pending_likes, with_liked_by_me
+from controllers.user_stats_controller import get_user_stats
+
+# authors with at least this many followers are not fanned out on write,
+# their tweets are merged into their followers' timelines when they are read
+TIMELINE_CELEBRITY_FOLLOWERS = int(os.getenv("TIMELINE_CELEBRITY_FOLLOWERS", "10000"))
+# how many rows a timeline keeps, older ones are trimmed by trim_timelines()
+TIMELINE_MAX_ENTRIES = int(os.getenv("TIMELINE_MAX_ENTRIES", "800"))
+# how many recent tweets of a user are copied into a timeline when they are followed
+TIMELINE_BACKFILL = int(os.getenv("TIMELINE_BACKFILL", "50"))
+
+def is_celebrity(db: Session, user_id: int) -> bool:
+    return get_user_stats(db, user_id)["followers"] >= TIMELINE_CELEBRITY_FOLLOWERS
+
+# the helpers below only add to the session, the controller that calls them commits,
+# so the timelines change in the same transaction as the tweet or follow they mirror
+
+# called by create_tweet and create_tweets
+def fan_out_tweets(db: Session, author_id: int, tweet_ids: list):
+    """
+    Copy new tweets of one author into the timeline of every follower, in one INSERT ... SELECT.
+    The author always gets them in their own timeline; the followers of a celebrity don't,
+    they read the celebrity's tweets directly (see get_home_timeline)
+    """
+    columns = ["user_id", "tweet_id", "author_id", "created_at"]
+    own = select(Tweet.user_id, Tweet.id, Tweet.user_id, Tweet.created_at).where(Tweet.id.in_(tweet_ids))
+    db.execute(insert(HomeTimeline).from_select(columns, own))
+
+    if not is_celebrity(db, author_id):
+        followers = select(
+            Follow.follower_id, Tweet.id, Tweet.user_id, Tweet.created_at
+        ).join(Tweet, Tweet.user_id == Follow.following_id).where(Tweet.id.in_(tweet_ids))
+        db.execute(insert(HomeTimeline).from_select(columns, followers))
+
+def fan_out_tweet(db: Session, tweet: Tweet):
+    fan_out_tweets(db, tweet.user_id, [tweet.id])
+
+# called by follow_user
+def backfill_timeline(db: Session, user_id: int, author_id: int):
+    """Copy the latest tweets of a newly followed user into the follower's timeline"""
+    if is_celebrity(db, author_id):
+        return
+    recent = (
+        select(Tweet.id, Tweet.created_at)
+        .where(Tweet.user_id == author_id)
+        .order_by(Tweet.created_at.desc(), Tweet.id.desc())
+        .limit(TIMELINE_BACKFILL)
+        .subquery()
+    )
+    rows = select(literal(user_id), recent.c.id, literal(author_id), recent.c.created_at).where(
+        # a fan-out that ran in the meantime may already have added a row
+        ~exists().where(HomeTimeline.user_id == user_id, HomeTimeline.tweet_id == recent.c.id)
+    )
+    db.execute(insert(HomeTimeline).from_select(["user_id", "tweet_id", "author_id", "created_at"], rows))
+
+def backfill_timelines(db: Session) -> int:
+    """
+    Fill the timelines of every user from the follows and tweets that existed before the
+    timelines did, returns how many rows were added.
+    Only runs while home_timeline is empty (the first start after deploying it), from then on
+    fan_out_tweets and backfill_timeline keep the timelines up to date.
+    Every user gets the latest TIMELINE_BACKFILL tweets of themselves and of everyone they follow
+    that is not a celebrity, in two set-based INSERT ... SELECTs. Run at startup by the app (see app.py)
+    """
+    if db.query(HomeTimeline.id).first() is not None:
+        return 0
+
+    recent = select(
+        Tweet.id, Tweet.user_id, Tweet.created_at,
+        func.row_number().over(
+            partition_by=Tweet.user_id,
+            order_by=(Tweet.created_at.desc(), Tweet.id.desc())
+        ).label("position")
+    ).subquery()
+    columns = ["user_id", "tweet_id", "author_id", "created_at"]
+    # a fan-out that runs in the meantime may already have added a row
+    not_added = lambda user_id: ~exists().where(HomeTimeline.user_id == user_id, HomeTimeline.tweet_id == recent.c.id)
+
+    own = select(recent.c.user_id, recent.c.id, recent.c.user_id, recent.c.created_at).where(
+        recent.c.position <= TIMELINE_BACKFILL,
+        not_added(recent.c.user_id)
+    )
+    added = db.execute(insert(HomeTimeline).from_select(columns, own)).rowcount
+
+    follow_of_author = aliased(Follow)
+    followers = select(func.count(follow_of_author.id)).where(
+        follow_of_author.following_id == recent.c.user_id
+    ).scalar_subquery()
+    followed = select(Follow.follower_id, recent.c.id, recent.c.user_id, recent.c.created_at).join(
+        recent, recent.c.user_id == Follow.following_id
+    ).where(
+        recent.c.position <= TIMELINE_BACKFILL,
+        followers < TIMELINE_CELEBRITY_FOLLOWERS,
+        not_added(Follow.follower_id)
+    )
+    added += db.execute(insert(HomeTimeline).from_select(columns, followed)).rowcount
+    db.commit()
+    return added
+
+# called by unfollow_user
+def remove_author_from_timeline(db: Session, user_id: int, author_id: int):
+    """Take the tweets of an unfollowed user out of the timeline"""
+    db.query(HomeTimeline).filter(
+        HomeTimeline.user_id == user_id,
+        HomeTimeline.author_id == author_id
+    ).delete(synchronize_session=False)
+
+# called by delete_tweet and delete_user_by_id, the foreign keys cascade too
+# but this also covers databases that don't enforce them (SQLite)
+def remove_tweet_from_timelines(db: Session, tweet_id: int):
+    db.query(HomeTimeline).filter(HomeTimeline.tweet_id == tweet_id).delete(synchronize_session=False)
+
+def remove_user_from_timelines(db: Session, user_id: int):
+    db.query(HomeTimeline).filter(
+        (HomeTimeline.user_id == user_id) | (HomeTimeline.author_id == user_id)
+    ).delete(synchronize_session=False)
+
+def trim_timelines(db: Session) -> int:
+    """
+    Keep only the newest TIMELINE_MAX_ENTRIES rows of every timeline, returns how many were removed.
+    One set-based DELETE, run in the background by the app (see app.py)
+    """
+    ranked = select(
+        HomeTimeline.id,
+        func.row_number().over(
+            partition_by=HomeTimeline.user_id,
+            order_by=(HomeTimeline.created_at.desc(), HomeTimeline.tweet_id.desc())
+        ).label("position")
+    ).subquery()
+    removed = db.query(HomeTimeline).filter(
+        HomeTimeline.id.in_(select(ranked.c.id).where(ranked.c.position > TIMELINE_MAX_ENTRIES))
+    ).delete(synchronize_session=False)
+    db.commit()
+    return removed
+
+@cached("followed_celebrities_{user_id}", ttl=300, tags=["following:{user_id}"])
+def get_followed_celebrities(user_id: int, db: Session) -> list:
+    """
+    ids of the users this user follows that are not fanned out on write.
+    An author who drops back under the threshold stops being merged in, their tweets from
+    the celebrity period are then only in their own list (GET /users/{id}/tweets)
+    """
+    rows = (
+        db.query(Follow.following_id)
+        .join(UserStats, UserStats.user_id == Follow.following_id)
+        .filter(Follow.follower_id == user_id, UserStats.followers_count >= TIMELINE_CELEBRITY_FOLLOWERS)
+        .all()
+    )
+    return [row[0] for row in rows]
+
+# @desc Get the home timeline of the current user, newest first
+# @route GET /users/me/timeline?before={created_at,id}&limit={n}
+def get_home_timeline(user_id: int, db: Session, before: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    """
+    One page of the user's home timeline.
+    Reads limit + 1 rows of the materialized timeline and, if the user follows celebrities,
+    limit + 1 of their tweets, and merges the two. Both reads are index range scans,
+    so a page costs O(limit) whatever the number of tweets or follows.
+
+    :return: {"tweets": [...], "next_cursor": cursor of the next page or None on the last page}
+    """
+    timeline = db.query(HomeTimeline.created_at, HomeTimeline.tweet_id).filter(HomeTimeline.user_id == user_id)
+    keys = keyset_page(timeline, HomeTimeline.created_at, HomeTimeline.tweet_id, before).limit(limit + 1).all()
+
+    celebrities = get_followed_celebrities(user_id, db)
+    if celebrities:
+        # fan-out on read for the authors that were skipped on write
+        pulled = db.query(Tweet.created_at, Tweet.id).filter(Tweet.user_id.in_(celebrities))
+        keys += keyset_page(pulled, Tweet.created_at, Tweet.id, before).limit(limit + 1).all()
+        # an author that became a celebrity may have tweets in both
+        keys = sorted(set(keys), reverse=True)[:limit + 1]
+
+    page = keys[:limit]
+    ids = [tweet_id for _, tweet_id in page]
+    tweets = {tweet.id: tweet for tweet in db.query(Tweet).filter(Tweet.id.in_(ids)).all()} if ids else {}
+
+    next_cursor = None
+    if len(keys) > limit:
+        next_cursor = encode_cursor(*page[-1])
+
+    # a tweet deleted between the two queries is skipped
+    found = with_pending_likes([tweet_to_dict(tweets[tweet_id]) for tweet_id in ids if tweet_id in tweets])
+    return {"tweets": with_liked_by_me(db, user_id, found), "next_cursor": next_cursor}
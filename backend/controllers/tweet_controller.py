@@ -1,11 +1,82 @@
 from fastapi import HTTPException, status
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from fastapi.encoders import jsonable_encoder
 from models.tweet_schema import Tweet
-from models.hashtag_schema import Hashtag
+from models.hashtag_schema import Hashtag, tweet_hashtags
 from models.like_schema import Like
 import re
-from cache.db_cache import get_from_cache, save_to_cache
+import json
+from cache.db_cache import cached, invalidate
+from deploy import SessionLocal
+from controllers.pagination import DEFAULT_PAGE_SIZE, encode_cursor, keyset_page
+from controllers.tweet_queries import tweet_to_dict, with_pending_likes, with_like_counts, with_liked_by_me, pending_likes
+from controllers.timeline_controller import fan_out_tweet, fan_out_tweets, remove_tweet_from_timelines
+from services.hashtag_index import hashtag_index
+from services.trending import trending_hashtags
+from services.like_buffer import like_buffer
+from services.like_index import like_index
+from sqlalchemy.exc import IntegrityError
+
+def extract_hashtags(content: str) -> set:
+    """the hashtag names in a tweet, without the #"""
+    return set(re.findall(r"#(\w+)", content or ""))
+
+def insert_ignoring_conflicts(db: Session, table):
+    """INSERT ... ON CONFLICT DO NOTHING for the databases that have it, None for the others"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql_insert(table).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite_insert(table).on_conflict_do_nothing()
+    return None
+
+def resolve_hashtags(db: Session, names) -> dict:
+    """
+    {name: hashtag id} for every name, creating the hashtags that don't exist yet.
+    A constant number of queries whatever the number of names: one SELECT for the ones that exist,
+    one INSERT ... ON CONFLICT DO NOTHING RETURNING for the new ones, and one more SELECT only if
+    another request created some of them at the same moment
+    """
+    names = set(names)
+    if not names:
+        return {}
+    ids = dict(db.query(Hashtag.name, Hashtag.id).filter(Hashtag.name.in_(names)).all())
+    missing = names - ids.keys()
+    if not missing:
+        return ids
+
+    statement = insert_ignoring_conflicts(db, Hashtag)
+    if statement is None:
+        # no upsert on this database, one insert per new hashtag
+        for name in missing:
+            hashtag = Hashtag(name=name)
+            db.add(hashtag)
+            db.flush()
+            ids[name] = hashtag.id
+        return ids
+
+    created = db.execute(
+        statement.returning(Hashtag.name, Hashtag.id),
+        [{"name": name} for name in missing]
+    ).all()
+    ids.update(dict(created))
+    raced = names - ids.keys()
+    if raced:
+        ids.update(dict(db.query(Hashtag.name, Hashtag.id).filter(Hashtag.name.in_(raced)).all()))
+    return ids
+
+def after_tweets_created(author_id: int, hashtags_per_tweet: list):
+    """caches, autocomplete index and trending counters, once new tweets are committed"""
+    # the feed, searches and the author's tweet list are stale now
+    invalidate("tweets", f"tweets_of:{author_id}")
+    # keep the autocomplete index and the trending counters in step without reloading them
+    for names in hashtags_per_tweet:
+        for name in names:
+            hashtag_index.record(name)
+        trending_hashtags.record(names)
 
 # create a new tweet
 # route POST /tweets
@@ -19,95 +90,120 @@ def create_tweet(db: Session, tweet_data: dict) -> Tweet:
     # dictionary unpacking (**) lets me pass key-value pairs in a dictionary as separate keyword arguments to a function or constructor
     new_tweet = Tweet(**tweet_data)
 
-    # extract hashtags from content
-    hashtags_content = set(re.findall(r"#(\w+)", tweet_data.get("content", "")))
-    for tag in hashtags_content:
-        hashtag_obj = db.query(Hashtag).filter(Hashtag.name == tag).first()
-        if not hashtag_obj:
-            hashtag_obj = Hashtag(name=tag)
-            db.add(hashtag_obj)
-            db.flush()  # make sure the hashtag has an id before association
-        # associate the hashtag with the tweet using the updated relationship name
-        new_tweet.hashtags.append(hashtag_obj)
-
     # the tweet is added to the session
     db.add(new_tweet)
+    db.flush()  # the tweet needs its id before hashtags and timelines can point to it
+
+    # extract hashtags from content, and link them all with one insert
+    hashtags_content = extract_hashtags(tweet_data.get("content"))
+    hashtag_ids = resolve_hashtags(db, hashtags_content)
+    if hashtag_ids:
+        db.execute(
+            insert(tweet_hashtags),
+            [{"tweet_id": new_tweet.id, "hashtag_id": hashtag_id} for hashtag_id in hashtag_ids.values()]
+        )
+
+    # copied into the followers' timelines in the same transaction, so a tweet is never missing from them
+    fan_out_tweet(db, new_tweet)
     db.commit()
     db.refresh(new_tweet)
+    after_tweets_created(new_tweet.user_id, [hashtags_content])
     return new_tweet
 
-# retrive all tweets
-# route GET /tweets
-def get_all_tweets(db: Session):
-    """
-    return a list of tweets, with 'likes' count
-    """
-    # Check cache first
-    cache_key = "all_tweets"
-    cached_result = get_from_cache(cache_key)
-    
-    # If we found it in cache, return it immediately
-    if cached_result is not None:
-        return cached_result
-    
-    # Not in cache, do the database query
-    rows = (
-        db.query(
-            Tweet,
-            func.count(Like.id).label("likes")
-        )
-        .outerjoin(Like, Like.tweetId == Tweet.id)
-        .group_by(Tweet.id)
-        .all()
-    )
+# create many tweets of one user at once, for importers
+# route POST /tweets/batch
+def create_tweets(db: Session, user_id: int, contents: list) -> list:
+    """
+    Insert all the tweets in one transaction: one multi-row INSERT into tweets, the hashtags of
+    the whole batch resolved together (see resolve_hashtags), one multi-row INSERT into
+    tweet_hashtags and one fan-out into the timelines. Either every tweet is created or none.
 
-    tweets = []
-    for tweet, likes in rows:
-        data = tweet.__dict__.copy()
-        data.pop("_sa_instance_state", None)
-        data["likes"] = likes
-        tweets.append(data)
+    :param user_id: author of every tweet
+    :param contents: the text of each tweet
+    :return: [{"id", "created_at"}] of the new tweets, in the order of contents
+    """
+    rows = db.execute(
+        insert(Tweet).returning(Tweet.id, Tweet.created_at, sort_by_parameter_order=True),
+        [{"user_id": user_id, "content": content} for content in contents]
+    ).all()
 
-    # Save to cache for next time
-    save_to_cache(cache_key, tweets)
-    
-    return tweets
+    hashtags_per_tweet = [extract_hashtags(content) for content in contents]
+    all_hashtags = set().union(*hashtags_per_tweet)
+    hashtag_ids = resolve_hashtags(db, all_hashtags)
+    links = [
+        {"tweet_id": tweet_id, "hashtag_id": hashtag_ids[name]}
+        for (tweet_id, _), names in zip(rows, hashtags_per_tweet)
+        for name in names
+    ]
+    if links:
+        db.execute(insert(tweet_hashtags), links)
+
+    fan_out_tweets(db, user_id, [tweet_id for tweet_id, _ in rows])
+    db.commit()
+
+    after_tweets_created(user_id, hashtags_per_tweet)
+    return [{"id": tweet_id, "created_at": created_at} for tweet_id, created_at in rows]
 
-# search for tweets that have the query string in their content
-# route GET /tweets/search?={query}
-def search_tweets(db: Session, query: str):
+def newest_first(db: Session, before: str = None):
     """
-    :param query: the search string
-    :return: a list of tweets that match the search query, if no tweets match it returns an empty list
+    query for tweets newest first, starting right after the 'before' cursor if given
     """
-    cache_key = f"search_tweets_{query}"
-    cached_result = get_from_cache(cache_key)
-    
-    if cached_result is not None:
-        print(f"DB Cache HIT: {cache_key}")
-        return cached_result
-    
-    print(f"DB Cache MISS: {cache_key}")
-    # .ilike() performs a case-insensitive match, it will find tweets regardless of letter case
-    # %{query}% allows matching the query string anywhere within the tweet content
-    tweets = db.query(Tweet).filter(Tweet.content.ilike(f"%{query}%")).all()
+    return keyset_page(db.query(Tweet), Tweet.created_at, Tweet.id, before)
 
-    save_to_cache(cache_key, tweets)
+@cached("tweets_page_{before}_{limit}", tags=["tweets"])
+def tweets_page(db: Session, before: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    # fetch one extra row to know if there is a next page
+    rows = newest_first(db, before).limit(limit + 1).all()
+    page = rows[:limit]
 
-    return tweets
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    return {"tweets": [tweet_to_dict(tweet) for tweet in page], "next_cursor": next_cursor}
+
+# retrive one page of tweets, newest first
+# route GET /tweets?before={created_at,id}&limit={n}
+def get_tweets_page(db: Session, before: str = None, limit: int = DEFAULT_PAGE_SIZE, viewer_id: int = None):
+    """
+    :param before: cursor of the last tweet of the previous page, None for the first page
+    :param limit: number of tweets in the page
+    :param viewer_id: the logged in user, for "liked_by_me"
+    :return: {"tweets": [...], "next_cursor": cursor for the next page or None on the last page}
+    """
+    # the page is cached, its like counts are not: a like doesn't have to invalidate every cached page
+    page = tweets_page(db, before, limit)
+    tweets = with_liked_by_me(db, viewer_id, with_like_counts(db, page["tweets"]))
+    return {"tweets": tweets, "next_cursor": page["next_cursor"]}
+
+# stream every tweet as newline-delimited JSON, for exports
+# route GET /tweets?format=ndjson
+def stream_tweets(before: str = None, batch_size: int = 500):
+    """
+    generator yielding one JSON line per tweet, newest first.
+    Reads the table in keyset batches, so memory use stays at one batch however big the export is.
+    Opens its own session because it keeps running after the route function has returned
+    """
+    db = SessionLocal()
+    try:
+        while True:
+            batch = newest_first(db, before).limit(batch_size).all()
+            if not batch:
+                return
+            for tweet in with_pending_likes([tweet_to_dict(tweet) for tweet in batch]):
+                yield json.dumps(jsonable_encoder(tweet)) + "\n"
+            last = batch[-1]
+            before = encode_cursor(last.created_at, last.id)
+            # don't keep every batch's objects in the identity map
+            db.expunge_all()
+    finally:
+        db.close()
 
 # search for tweets with hashtags that have the query string in their name
 # route GET /tweets/hashtag/search?={query}
+@cached("search_hashtags_{query}", tags=["tweets"])
 def search_hashtags(db: Session, query: str):
-    cache_key = f"search_hashtags_{query}"
-    cached_result = get_from_cache(cache_key)
-    
-    if cached_result is not None:
-        print(f"DB Cache HIT: {cache_key}")
-        return cached_result
-    
-    print(f"DB Cache MISS: {cache_key}")
-    # Not in cache, search in database
     tweets = (
         db.query(Tweet)
         # join the tweets table with the associated hashtags
@@ -115,10 +211,7 @@ def search_hashtags(db: Session, query: str):
         .filter(Hashtag.name.ilike(f"%{query}%"))
         .all()
     )
-    
-    # Save to cache
-    save_to_cache(cache_key, tweets)
-    
+
     return tweets
 
 # edit one tweet
@@ -140,6 +233,7 @@ def update_tweet(db: Session, tweet_id: int, tweet_data: dict) -> Tweet:
         setattr(tweet, key, value)
     # the changes are saved to the database
     db.commit()
+    invalidate("tweets", f"tweets_of:{tweet.user_id}")
     # updates the tweet instance with the latest data from the database
     db.refresh(tweet)
     return tweet
@@ -157,34 +251,84 @@ def delete_tweet(db: Session, tweet_id: int) -> bool:
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Tweet not found"
         )
+    author_id = tweet.user_id
+    remove_tweet_from_timelines(db, tweet_id)
     db.delete(tweet)
     db.commit()
+    invalidate("tweets", f"tweets_of:{author_id}")
     return {"message": "Tweet deleted successfully"}
 
-# add like and count the likes for a tweet
-# route POST /tweets/{tweet_id}/like
-def like_tweet(db: Session, tweet_id: int):
-    """
-    insert a new Like row for tweet_id, then return the total count
-    """
-    #check that the tweet exists
-    tweet = db.query(Tweet).filter(Tweet.id == tweet_id).first()
-    if tweet is None:
+def flushed_likes(db: Session, tweet_id: int) -> int:
+    """tweets.likes alone, 404 if the tweet doesn't exist"""
+    likes = db.query(Tweet.likes).filter(Tweet.id == tweet_id).scalar()
+    if likes is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Tweet not found"
         )
-    
-    #new like
-    new_like = Like(tweetId=tweet_id)
-    db.add(new_like)
-    db.commit()
+    return likes
 
-    #count all likes for this tweet
-    total_likes = (
-        db.query(func.count(Like.id))
-            .filter(Like.tweetId == tweet_id)
-            .scalar()
-    )
+def current_likes(db: Session, tweet_id: int) -> int:
+    """tweets.likes plus the likes still queued, 404 if the tweet doesn't exist"""
+    # pending first, see the ordering note in controllers/tweet_queries.py
+    pending = pending_likes([tweet_id]).get(tweet_id, 0)
+    return flushed_likes(db, tweet_id) + pending
+
+# which of the given tweets the current user liked
+# route GET /tweets/liked?ids={id},{id},...
+def get_liked_tweets(db: Session, user_id: int, tweet_ids: list):
+    """
+    {"liked": [the ids in tweet_ids that user_id liked]}, one lookup in the like index.
+    Lets clients read the tweet lists without a token (so the cache tier can share them)
+    and ask for their own like state separately
+    """
+    liked = like_index.liked(db, user_id, tweet_ids)
+    return {"liked": [tweet_id for tweet_id in tweet_ids if tweet_id in liked]}
+
+# add a like to a tweet
+# route POST /tweets/{tweet_id}/like
+def like_tweet(db: Session, tweet_id: int, user_id: int) -> int:
+    """
+    record that user_id likes tweet_id, once: liking a tweet again changes nothing.
+    The like row is written right away, the count goes through the in-memory like buffer,
+    it reaches like_cache.db within LIKE_BUFFER_FLUSH_MS and the worker adds it to tweets.likes later.
+    :return: the like count including this like, so the user sees their like right away
+    """
+    #check that the tweet exists, the queued likes are only read once for the answer
+    flushed_likes(db, tweet_id)
+
+    statement = insert_ignoring_conflicts(db, Like)
+    if statement is not None:
+        added = db.execute(statement.values(user_id=user_id, tweetId=tweet_id)).rowcount == 1
+        db.commit()
+    else:
+        try:
+            db.add(Like(user_id=user_id, tweetId=tweet_id))
+            db.commit()
+            added = True
+        except IntegrityError:
+            db.rollback()
+            added = False
+
+    if added:
+        like_buffer.add(tweet_id)
+        like_index.add(user_id, tweet_id)
+    return current_likes(db, tweet_id)
+
+# take back a like
+# route DELETE /tweets/{tweet_id}/like
+def unlike_tweet(db: Session, tweet_id: int, user_id: int) -> int:
+    """
+    remove user_id's like of tweet_id, nothing happens if they didn't like it.
+    :return: the like count without this like
+    """
+    #check that the tweet exists
+    flushed_likes(db, tweet_id)
+
+    removed = db.query(Like).filter(Like.user_id == user_id, Like.tweetId == tweet_id).delete(synchronize_session=False)
+    db.commit()
 
-    return {"likes": total_likes}
\ No newline at end of file
+    if removed:
+        like_buffer.add(tweet_id, -1)
+        like_index.remove(user_id, tweet_id)
+    return current_likes(db, tweet_id)
@@ -0,0 +1,88 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from models.tweet_schema import Tweet
+from batcher_db import SessionCache, LikeCache, LikeOutbox
+from services.like_buffer import like_buffer
+from services.like_index import like_index
+
+# shared by the tweet lists, the home timeline and search
+
+# likes are counted in one place: tweets.likes, kept up to date by the worker (worker.py)
+# which adds the likes queued in like_cache.db. A tweet's like count is tweets.likes plus
+# what is still queued for it (in like_cache.db or still in the in-memory like buffer),
+# so a like shows up right away, before the worker has run.
+# The places are read one after the other, not in one snapshot, in the order the likes move
+# through them backwards (buffer, like_cache, like_outbox, then tweets.likes): a like that moves on
+# in between is then counted twice for a moment instead of missed. with_pending_likes gets tweets
+# that were read before, there a batch the worker applies between the two reads is missing from
+# that one response (the next read is exact)
+
+def tweet_to_dict(tweet: Tweet) -> dict:
+    """the JSON shape of a tweet in lists, likes is the flushed count (see with_pending_likes)"""
+    return {
+        "id": tweet.id,
+        "user_id": tweet.user_id,
+        "content": tweet.content,
+        "created_at": tweet.created_at,
+        "updated_at": tweet.updated_at,
+        "likes": tweet.likes,
+    }
+
+def pending_likes(tweet_ids) -> dict:
+    """
+    {tweet_id: likes not added to tweets.likes yet}, the in-memory buffer plus
+    what like_cache.db has for them, queued or claimed by the worker
+    """
+    tweet_ids = list(tweet_ids)
+    if not tweet_ids:
+        return {}
+    # the buffer first, then like_cache, then like_outbox (see the ordering note at the top)
+    pending = like_buffer.pending(tweet_ids)
+    cache = SessionCache()
+    try:
+        rows = cache.query(LikeCache.tweetId, LikeCache.count).filter(LikeCache.tweetId.in_(tweet_ids)).all()
+        # batches the worker has claimed but not finished applying
+        rows += (
+            cache.query(LikeOutbox.tweetId, func.sum(LikeOutbox.count))
+            .filter(LikeOutbox.tweetId.in_(tweet_ids))
+            .group_by(LikeOutbox.tweetId)
+            .all()
+        )
+    finally:
+        cache.close()
+    for tweet_id, count in rows:
+        pending[tweet_id] = pending.get(tweet_id, 0) + count
+    return pending
+
+def with_pending_likes(tweets: list) -> list:
+    """tweet dicts fresh from the database, with the queued likes added (see the ordering note at the top)"""
+    pending = pending_likes(tweet["id"] for tweet in tweets)
+    for tweet in tweets:
+        tweet["likes"] += pending.get(tweet["id"], 0)
+    return tweets
+
+def with_like_counts(db: Session, tweets: list) -> list:
+    """
+    Copies of tweet dicts (e.g. from the cache) with their current like count:
+    tweets.likes of the listed ids plus the queued likes, so a cached list never shows old counts
+    """
+    ids = [tweet["id"] for tweet in tweets]
+    if not ids:
+        return []
+    # pending before tweets.likes, a batch applied in between is counted twice for a moment, never missed
+    pending = pending_likes(ids)
+    flushed = dict(db.query(Tweet.id, Tweet.likes).filter(Tweet.id.in_(ids)).all())
+    return [
+        {**tweet, "likes": flushed.get(tweet["id"], tweet["likes"]) + pending.get(tweet["id"], 0)}
+        for tweet in tweets
+    ]
+
+def with_liked_by_me(db: Session, user_id, tweets: list) -> list:
+    """
+    Sets "liked_by_me" on tweet dicts, with one lookup in the like index for the whole list.
+    Always False when nobody is logged in (user_id None)
+    """
+    liked = like_index.liked(db, user_id, (tweet["id"] for tweet in tweets)) if user_id is not None else set()
+    for tweet in tweets:
+        tweet["liked_by_me"] = tweet["id"] in liked
+    return tweets
@@ -2,12 +2,19 @@ from fastapi import HTTPException, status #exceptions are used as error handler,
 from sqlalchemy.orm import Session
 from models.user_schema import User
 from models.tweet_schema import Tweet
+from models.follow_schema import Follow
+from models.like_schema import Like
 import bcrypt 
 print("bcrypt module location:", bcrypt.__file__)
 print("Available attributes:", dir(bcrypt))
 from datetime import timedelta
 from middleware.auth import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
-from cache.db_cache import get_from_cache, save_to_cache
+from cache.db_cache import cached, invalidate
+from controllers.timeline_controller import remove_user_from_timelines
+from controllers.tweet_queries import tweet_to_dict, with_like_counts, with_liked_by_me
+from controllers.user_stats_controller import get_user_stats, create_user_stats, remove_user_from_counts
+from services.like_buffer import like_buffer
+from services.like_index import like_index
 
 # @desc create new account
 # route POST /api/users/register
@@ -35,8 +42,11 @@ def create_user(user, db: Session):
     )
     # Adds the user to the database and commits the transaction
     db.add(new_user)
+    db.flush()  # the user needs its id for the counters row
+    create_user_stats(db, new_user.id)
     db.commit()
     db.refresh(new_user)
+    invalidate("users")
     return new_user
 
 
@@ -95,18 +105,8 @@ def logout_user():
 
 # @desc retrieve all accouts
 # route GET /users
+@cached("all_users", tags=["users"])
 def getAll_users(db: Session):
-    # Check cache first
-    cache_key = "all_users"
-    cached_result = get_from_cache(cache_key)
-    
-    # If found in cache, return it
-    if cached_result is not None:
-        print(f"DB Cache HIT: {cache_key}")
-        return cached_result
-    
-    print(f"DB Cache MISS: {cache_key}")
-    # Not in cache, query the database
     users = db.query(User).all()
 
     # Process the results
@@ -124,10 +124,7 @@ def getAll_users(db: Session):
         "count": len(user_list),
         "users": user_list
     }
-    
-    # Save to cache
-    save_to_cache(cache_key, result)
-    
+
     return result
 
 # @desc retrieve specific accout
@@ -140,17 +137,8 @@ def getAll_users(db: Session):
     :return: User details if found
     :raises HTTPException: If user not found
     """
+@cached("user_{user_id}", tags=["user:{user_id}"])
 def get_user_by_id(user_id: int, db: Session):
-    # Use user ID in the cache key
-    cache_key = f"user_{user_id}"
-    cached_result = get_from_cache(cache_key)
-    
-    if cached_result is not None:
-        print(f"DB Cache HIT: {cache_key}")
-        return cached_result
-    
-    print(f"DB Cache MISS: {cache_key}")
-    # Not in cache, get from database
     user = db.query(User).filter(User.id == user_id).first()
 
     if not user:
@@ -170,10 +158,7 @@ def get_user_by_id(user_id: int, db: Session):
             "updated_at": user.updated_at
         }
     }
-    
-    # Save to cache
-    save_to_cache(cache_key, result)
-    
+
     return result
 
 # @desc delete your own account
@@ -202,8 +187,33 @@ def delete_user_by_id(user_id: int, db: Session, current_user):
             detail=f"User with ID {user_id} not found"
         )
     
+    # the follows of this user are deleted with it, so the lists of everyone on the
+    # other side of a follow change too
+    follows = db.query(Follow.follower_id, Follow.following_id).filter(
+        (Follow.follower_id == user_id) | (Follow.following_id == user_id)
+    ).all()
+
+    # their likes go too, and come off the like counts of the tweets they liked
+    liked = [row[0] for row in db.query(Like.tweetId).filter(Like.user_id == user_id).all()]
+    db.query(Like).filter(Like.user_id == user_id).delete(synchronize_session=False)
+
+    remove_user_from_timelines(db, user_id)
+    remove_user_from_counts(db, user_id, follows)
     db.delete(user)
     db.commit()
+
+    for tweet_id in liked:
+        like_buffer.add(tweet_id, -1)
+    like_index.forget(user_id)
+
+    stale_tags = ["users", "tweets", f"user:{user_id}", f"tweets_of:{user_id}",
+                  f"following:{user_id}", f"followers:{user_id}"]
+    for follower_id, following_id in follows:
+        if follower_id == user_id:
+            stale_tags.append(f"followers:{following_id}")
+        else:
+            stale_tags.append(f"following:{follower_id}")
+    invalidate(*stale_tags)
     
     return {
         "message": f"User with ID {user_id} has been deleted"
@@ -211,17 +221,10 @@ def delete_user_by_id(user_id: int, db: Session, current_user):
 
 # @desc search for account
 # route GET /users/search?q={query}
+@cached("user_search_{username}", tags=[
+    lambda result: [f"user:{result['user']['id']}", f"followers:{result['user']['id']}", f"following:{result['user']['id']}"]
+])
 def search_user_by_username(username: str, db: Session):
-    # Use username in the cache key
-    cache_key = f"user_search_{username}"
-    cached_result = get_from_cache(cache_key)
-    
-    if cached_result is not None:
-        print(f"DB Cache HIT: {cache_key}")
-        return cached_result
-    
-    print(f"DB Cache MISS: {cache_key}")
-    # Not in cache, search in database
     user = db.query(User).filter(User.username == username).first()
     
     if not user:
@@ -230,6 +233,7 @@ def search_user_by_username(username: str, db: Session):
             detail=f"User with username {username} not found"
         )
     
+    stats = get_user_stats(db, user.id)
     result = {
         "user": {
             "id": user.id,
@@ -239,34 +243,24 @@ def search_user_by_username(username: str, db: Session):
             "bio": user.bio,
             "created_at": user.created_at,
             "updated_at": user.updated_at,
-            "following": 0, 
-            "followers": 0,
+            "following": stats["following"],
+            "followers": stats["followers"],
             "joinDate": user.created_at.strftime("%B %Y")
         }
     }
-    
-    # Save to cache
-    save_to_cache(cache_key, result)
-    
+
+    return result
+
+@cached("user_tweets_{user_id}", tags=["tweets_of:{user_id}"])
+def user_tweets(user_id: int, db: Session):
+    tweets = db.query(Tweet).filter(Tweet.user_id == user_id).all()
+    result = {"tweets": [tweet_to_dict(tweet) for tweet in tweets]}
+
     return result
 
 # @desc retrieve all tweets made by the user with the given user_id
 # route GET /users/{userId}/tweets
-def get_tweets_by_user(user_id: int, db: Session):
-    # Use user ID in the cache key
-    cache_key = f"user_tweets_{user_id}"
-    cached_result = get_from_cache(cache_key)
-    
-    if cached_result is not None:
-        print(f"DB Cache HIT: {cache_key}")
-        return cached_result
-    
-    print(f"DB Cache MISS: {cache_key}")
-    # Not in cache, get from database
-    tweets = db.query(Tweet).filter(Tweet.user_id == user_id).all()
-    result = {"tweets": tweets}
-    
-    # Save to cache
-    save_to_cache(cache_key, result)
-    
-    return result
\ No newline at end of file
+def get_tweets_by_user(user_id: int, db: Session, viewer_id: int = None):
+    # the list is cached, the like counts and "liked_by_me" are read fresh
+    tweets = with_like_counts(db, user_tweets(user_id, db)["tweets"])
+    return {"tweets": with_liked_by_me(db, viewer_id, tweets)}
\ No newline at end of file
@@ -0,0 +1,82 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, select, exists, literal
+from models.user_schema import User
+from models.follow_schema import Follow
+from models.user_stats_schema import UserStats
+
+# the helpers below only add to the session, the controller that calls them commits,
+# so a count changes in the same transaction as the follow it counts
+
+def get_user_stats(db: Session, user_id: int) -> dict:
+    """{"followers": n, "following": n} for a user, one primary key lookup"""
+    stats = db.query(UserStats).filter(UserStats.user_id == user_id).first()
+    if stats is None:
+        return {"followers": 0, "following": 0}
+    return {"followers": stats.followers_count, "following": stats.following_count}
+
+def count_follows(db: Session, user_id: int):
+    """(followers, following) counted from the follows table, only used to (re)build a counter row"""
+    followers = db.query(func.count(Follow.id)).filter(Follow.following_id == user_id).scalar()
+    following = db.query(func.count(Follow.id)).filter(Follow.follower_id == user_id).scalar()
+    return followers, following
+
+def add_to_count(db: Session, user_id: int, column, delta: int):
+    """
+    Atomic column = column + delta, done by the database so two concurrent follows can't lose an update.
+    A user without a counter row yet (created before the table existed) gets one counted from follows,
+    which already includes the change of this transaction
+    """
+    updated = db.query(UserStats).filter(UserStats.user_id == user_id).update(
+        {column: column + delta}, synchronize_session=False
+    )
+    if updated == 0:
+        followers, following = count_follows(db, user_id)
+        db.add(UserStats(user_id=user_id, followers_count=followers, following_count=following))
+
+# called by follow_user (delta=1) and unfollow_user (delta=-1), after the follow row was added/deleted
+def update_follow_counts(db: Session, follower_id: int, following_id: int, delta: int):
+    db.flush()
+    add_to_count(db, follower_id, UserStats.following_count, delta)
+    add_to_count(db, following_id, UserStats.followers_count, delta)
+
+# called by create_user
+def create_user_stats(db: Session, user_id: int):
+    db.add(UserStats(user_id=user_id, followers_count=0, following_count=0))
+
+# called by delete_user_by_id with the follows of the deleted user, before they cascade away
+def remove_user_from_counts(db: Session, user_id: int, follows):
+    """Every user on the other side of a follow of the deleted user loses one follower/following"""
+    followed = [following_id for follower_id, following_id in follows if follower_id == user_id]
+    followers = [follower_id for follower_id, following_id in follows if following_id == user_id]
+    if followed:
+        db.query(UserStats).filter(UserStats.user_id.in_(followed)).update(
+            {UserStats.followers_count: UserStats.followers_count - 1}, synchronize_session=False
+        )
+    if followers:
+        db.query(UserStats).filter(UserStats.user_id.in_(followers)).update(
+            {UserStats.following_count: UserStats.following_count - 1}, synchronize_session=False
+        )
+    db.query(UserStats).filter(UserStats.user_id == user_id).delete(synchronize_session=False)
+
+def reconcile_user_stats(db: Session) -> int:
+    """
+    Recount every counter from the follows table and fix the ones that drifted
+    (writes that bypassed the controllers, manual fixes in the database...).
+    Set-based: one INSERT for users without a row, one UPDATE for the wrong rows.
+    Run at startup and in the background by the app (see app.py), returns how many rows were fixed
+    """
+    missing = select(User.id, literal(0), literal(0)).where(
+        ~exists().where(UserStats.user_id == User.id)
+    )
+    db.execute(insert(UserStats).from_select(["user_id", "followers_count", "following_count"], missing))
+
+    followers = select(func.count(Follow.id)).where(Follow.following_id == UserStats.user_id).scalar_subquery()
+    following = select(func.count(Follow.id)).where(Follow.follower_id == UserStats.user_id).scalar_subquery()
+    fixed = db.query(UserStats).filter(
+        (UserStats.followers_count != followers) | (UserStats.following_count != following)
+    ).update(
+        {UserStats.followers_count: followers, UserStats.following_count: following},
+        synchronize_session=False
+    )
+    db.commit()
+    return fixed
@@ -19,6 +19,8 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
 
 # This tells FastAPI where your login endpoint is
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='users/login')
+# same, but a request without a token gets None instead of a 401
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl='users/login', auto_error=False)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     '''
@@ -83,6 +85,23 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         
     return user
 
+def get_optional_user(token: Optional[str] = Depends(optional_oauth2_scheme), db: Session = Depends(get_db)):
+    """
+    The current user for routes that also work without logging in (e.g. "liked_by_me" in tweet lists)
+
+    Returns:
+        The user, or None if there is no token or it is invalid or expired
+    """
+    if token is None:
+        return None
+    try:
+        user_id = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+    if user_id is None:
+        return None
+    return db.query(User).filter(User.id == user_id).first()
+
 
 '''
 What is JWT?
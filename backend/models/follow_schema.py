@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, ForeignKey, DateTime, UniqueConstraint
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, UniqueConstraint, Index
 from sqlalchemy.sql import func
 from config.db import Base
 
@@ -13,4 +13,7 @@ class Follow(Base):
     # create a unique constraint to prevent duplicate follows
     __table_args__ = (
         UniqueConstraint('follower_id', 'following_id', name='unique_follow'),
+        # follower/following lists are read newest first, one page at a time
+        Index('ix_follows_following_created_at', 'following_id', 'created_at', 'id'),
+        Index('ix_follows_follower_created_at', 'follower_id', 'created_at', 'id'),
     )
\ No newline at end of file
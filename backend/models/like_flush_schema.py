@@ -0,0 +1,15 @@
+import time
+from sqlalchemy import Column, String, Float
+from config.db import Base
+
+class LikeFlush(Base):
+    """
+    One row per batch of likes the worker added to tweets.likes (see worker.py).
+    Written in the same transaction as the increments, so a batch that is retried
+    after a crash is recognized and not added twice
+    """
+    __tablename__ = "like_flushes"
+
+    batch_id = Column(String(32), primary_key=True)
+    # unix time like like_cache.firstSeenAt, old rows are pruned by the worker
+    applied_at = Column(Float, default=time.time, nullable=False, index=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, ForeignKey, DateTime, func
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Index, func
 from sqlalchemy.orm import relationship
 from config.db import Base
 
@@ -7,7 +7,15 @@ class Like(Base):
 
     id = Column(Integer, primary_key=True)
     tweetId = Column(Integer, ForeignKey("tweets.id"), nullable=False)
+    # who liked the tweet, empty for likes from before likes were per user
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
     created_at = Column(DateTime, default=func.now())
 
     # relationship to tweets
-    tweet = relationship("Tweet", back_populates="likes")
\ No newline at end of file
+    tweet = relationship("Tweet", back_populates="like_rows")
+
+    __table_args__ = (
+        # a user likes a tweet at most once, also serves WHERE user_id = ? (see services/like_index.py)
+        # an index rather than a UniqueConstraint so sync_schema adds it to an existing likes table
+        Index("ux_likes_user_tweet", "user_id", "tweetId", unique=True),
+    )
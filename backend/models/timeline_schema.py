@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, Index, UniqueConstraint
+from config.db import Base
+
+class HomeTimeline(Base):
+    """
+    One row per tweet in a user's home timeline (tweets of the people they follow, and their own).
+    Filled when a tweet is created (fan-out on write), so reading a timeline page is one index range scan
+    """
+    __tablename__ = "home_timeline"
+
+    id = Column(Integer, primary_key=True)
+    # whose timeline the row belongs to
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    tweet_id = Column(Integer, ForeignKey("tweets.id", ondelete="CASCADE"), nullable=False, index=True)
+    # who wrote the tweet, so an unfollow can remove that author's rows
+    author_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # copy of the tweet's created_at, so the timeline can be ordered without touching the tweets table
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # a tweet shows up only once per timeline
+        UniqueConstraint("user_id", "tweet_id", name="unique_timeline_tweet"),
+        # serves WHERE user_id = ? ORDER BY created_at DESC, tweet_id DESC
+        Index("ix_home_timeline_user_created_at", "user_id", "created_at", "tweet_id"),
+        Index("ix_home_timeline_user_author", "user_id", "author_id"),
+    )
@@ -1,9 +1,16 @@
-from sqlalchemy import Column, Integer, Text, DateTime, ForeignKey, func
+from sqlalchemy import Column, Integer, Text, DateTime, ForeignKey, Index, func
 from sqlalchemy.orm import relationship
 from config.db import Base
 
 class Tweet(Base):
     __tablename__ = "tweets"
+    # newest-first feed pages are read with WHERE (created_at, id) < cursor ORDER BY created_at DESC, id DESC,
+    # this index serves that order (scanned backwards) so a page costs the same no matter how many tweets there are
+    __table_args__ = (
+        Index("ix_tweets_created_at_id", "created_at", "id"),
+        # the same order for the tweets of one user (timeline backfill, celebrity tweets read into timelines)
+        Index("ix_tweets_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     # ondelete="CASCADE" makes sure that if a user is deleted, their tweets are also removed
@@ -12,9 +19,11 @@ class Tweet(Base):
     content = Column(Text, nullable=False)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    # number of likes, the one place likes are counted (see controllers/tweet_queries.py)
     likes = Column(Integer, default=0, nullable=False)
 
     # establishes relationships
     user = relationship("User", back_populates="tweets")
     hashtags = relationship("Hashtag", secondary="tweet_hashtags", back_populates="tweets")
-    likes = relationship("Like", back_populates="tweet", lazy="dynamic", cascade="all, delete") #lazy so we can call .count()
+    # the Like rows of this tweet, named like_rows so it doesn't shadow the likes counter column above
+    like_rows = relationship("Like", back_populates="tweet", lazy="dynamic", cascade="all, delete") #lazy so we can call .count()
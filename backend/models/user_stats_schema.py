@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Integer, ForeignKey
+from config.db import Base
+
+class UserStats(Base):
+    """
+    Follower/following counts of a user, kept up to date by follow_user/unfollow_user
+    so a profile doesn't have to COUNT(*) the follows table
+    """
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    followers_count = Column(Integer, default=0, nullable=False)
+    following_count = Column(Integer, default=0, nullable=False)
@@ -1,13 +1,18 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from typing import Optional
 from sqlalchemy.orm import Session
 from config.db import get_db
-from validators.tweet_validate import TweetCreate, TweetUpdate
-from controllers.tweet_controller import create_tweet, get_all_tweets, update_tweet, delete_tweet, search_tweets, search_hashtags, like_tweet
+from validators.tweet_validate import TweetCreate, TweetUpdate, TweetBatchCreate
+from controllers.tweet_controller import create_tweet, create_tweets, get_tweets_page, stream_tweets, update_tweet, delete_tweet, search_hashtags, like_tweet, unlike_tweet, get_liked_tweets
+from controllers.search_controller import search_tweets
+from services.hashtag_index import hashtag_index, HASHTAG_SUGGEST_LIMIT
+from services.trending import trending_hashtags, TRENDING_TOP_K
 from models.user_schema import User
-from middleware.auth import get_current_user
+from middleware.auth import get_current_user, get_optional_user
+from controllers.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, set_next_cursor
 
-from batcher_db import SessionCache, LikeCache
-import time
+from urllib.parse import quote
 
 tweet_router = APIRouter(
     prefix="/tweets",
@@ -22,18 +27,86 @@ def post_tweet(tweet: TweetCreate, db: Session = Depends(get_db), current_user:
     tweet_data["user_id"] = current_user.id
     return create_tweet(db, tweet_data)
 
+# create many tweets at once (importers, integrations), all in one transaction
+# every tweet is posted by the current user
+@tweet_router.post("/batch", status_code=201)
+def post_tweets(batch: TweetBatchCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    created = create_tweets(db, current_user.id, [tweet.content for tweet in batch.tweets])
+    return {"count": len(created), "tweets": created}
+
+# newest tweets first, one page at a time
+# the body stays a plain list of tweets, the cursor of the next page is in the
+# X-Next-Cursor header (and a Link header), pass it back as ?before= to get the next page
+# ?format=ndjson streams every tweet instead, one JSON object per line
+# with a token every tweet of a page says if the logged in user liked it ("liked_by_me")
 @tweet_router.get("")
-def read_all_tweets(db: Session = Depends(get_db)):
-    return get_all_tweets(db)
+def read_all_tweets(
+    response: Response,
+    before: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    db: Session = Depends(get_db),
+    viewer: Optional[User] = Depends(get_optional_user)
+):
+    if format == "ndjson":
+        return StreamingResponse(stream_tweets(before), media_type="application/x-ndjson")
+
+    page = get_tweets_page(db, before, limit, viewer.id if viewer else None)
+    set_next_cursor(response, "/api/tweets", page["next_cursor"], limit)
+    return page["tweets"]
 
+# full-text search, best matches first
+# the body is a list of tweets with "rank" and "highlight", the next page cursor is in the X-Next-Cursor header
 @tweet_router.get("/search")
-def search_for_tweets(query: str, db: Session = Depends(get_db)):
-    return search_tweets(db, query)
+def search_for_tweets(
+    response: Response,
+    query: str,
+    before: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    viewer: Optional[User] = Depends(get_optional_user)
+):
+    page = search_tweets(db, query, before, limit, viewer.id if viewer else None)
+    set_next_cursor(response, f"/api/tweets/search?query={quote(query)}", page["next_cursor"], limit)
+    return page["tweets"]
+
+# hashtag autocomplete, the most used hashtags starting with prefix
+# served from the in-memory index, no database query
+@tweet_router.get("/hashtag/suggest")
+def suggest_hashtags(prefix: str, limit: int = Query(HASHTAG_SUGGEST_LIMIT, ge=1, le=HASHTAG_SUGGEST_LIMIT)):
+    return hashtag_index.suggest(prefix, limit)
+
+# hashtags with the most uses over the last hour (window=1h) or day (window=24h)
+# served from in-memory counters, no database query
+@tweet_router.get("/hashtag/trending")
+def trending(window: str = "1h", limit: int = Query(TRENDING_TOP_K, ge=1, le=TRENDING_TOP_K)):
+    if window not in trending_hashtags.windows:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"window must be one of {', '.join(trending_hashtags.windows)}"
+        )
+    return trending_hashtags.top(window, limit)
 
 @tweet_router.get("/hashtag/search")
 def search_for_hashtags(query: str, db: Session = Depends(get_db)):
     return search_hashtags(db, query)
 
+# which of the given tweets the current user liked, e.g. ?ids=4,8,15
+# personal, so the cache tier never stores it; the tweet lists themselves stay anonymous and cached
+@tweet_router.get("/liked")
+def read_liked_tweets(
+    ids: str = Query(..., pattern=r"^\d+(,\d+)*$"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    tweet_ids = [int(tweet_id) for tweet_id in ids.split(",")]
+    if len(tweet_ids) > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_PAGE_SIZE} ids at a time"
+        )
+    return get_liked_tweets(db, current_user.id, tweet_ids)
+
 @tweet_router.patch("/{tweet_id}")
 def put_tweet(tweet_id: int, tweet: TweetUpdate, db: Session = Depends(get_db)):
     return update_tweet(db, tweet_id, tweet.model_dump())
@@ -43,22 +116,17 @@ def remove_tweet(tweet_id: int, db: Session = Depends(get_db)):
     return delete_tweet(db, tweet_id)
 
 @tweet_router.post("/{tweet_id}/like", status_code=202)
-def post_like(tweet_id: int, db: Session = Depends(get_db)):
+def post_like(tweet_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     """
-    enqueue a like: increment or insert into SQLite cache.
+    like a tweet as the current user (once, liking it again changes nothing),
+    the worker adds it to the tweet's like count in batches.
+    "cached" is the like count including this like (the frontend shows it right away)
     """
-    cache = SessionCache()
-    now = time.time()
-
-    obj = cache.get(LikeCache, tweet_id)
-    if obj:
-        obj.count += 1
-    else:
-        # new batch for this tweet
-        obj = LikeCache(tweetId=tweet_id, count=1, firstSeenAt=now)
-        cache.add(obj)
-
-    cache.commit()
-    cache.close()
+    likes = like_tweet(db, tweet_id, current_user.id)
+    return {"status": "queued", "likes": likes, "cached": likes, "liked_by_me": True}
 
-    return {"status": "queued", "cached": obj.count}
\ No newline at end of file
+@tweet_router.delete("/{tweet_id}/like", status_code=202)
+def delete_like(tweet_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """take back the current user's like, "likes" is the count without it"""
+    likes = unlike_tweet(db, tweet_id, current_user.id)
+    return {"status": "queued", "likes": likes, "cached": likes, "liked_by_me": False}
@@ -1,10 +1,13 @@
-from fastapi import APIRouter, FastAPI, Depends, HTTPException
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Query, Response
+from typing import Optional
 from sqlalchemy.orm import Session
 from config.db import get_db
 from validators.user_validate import UserCreate, UserResponse, UserLogin
 from controllers.user_controller import create_user, login_user, logout_user, delete_user_by_id, search_user_by_username, get_tweets_by_user, getAll_users
-from controllers.following_controller import follow_user, unfollow_user, get_user_following,  get_followers_count, get_following_count, get_user_followers
-from middleware.auth import get_current_user
+from controllers.following_controller import follow_user, unfollow_user, get_user_following,  get_followers_count, get_following_count, get_user_followers, get_following_status
+from controllers.timeline_controller import get_home_timeline
+from controllers.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, set_next_cursor
+from middleware.auth import get_current_user, get_optional_user
 from fastapi.security import OAuth2PasswordRequestForm
 from models.follow_schema import Follow
 
@@ -65,6 +68,21 @@ async def get_current_user_info(current_user = Depends(get_current_user)):
         "bio": current_user.bio
     }
 
+# tweets of the people the current user follows (and their own), newest first
+# the body is a list of tweets like GET /tweets, the next page cursor is in the X-Next-Cursor header
+# plain def so FastAPI runs the database work in its threadpool
+@userRouter.get("/me/timeline")
+def get_my_timeline(
+    response: Response,
+    before: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    page = get_home_timeline(current_user.id, db, before, limit)
+    set_next_cursor(response, "/api/users/me/timeline", page["next_cursor"], limit)
+    return page["tweets"]
+
 # In FastAPI, route order matters. When you have a route with a path parameter like /{user_id} 
 # and another specific route like /search, the more specific route (/search) needs to be defined first
 @userRouter.get("/search")
@@ -72,9 +90,10 @@ async def search_users(q: str, db: Session = Depends(get_db)):
     return search_user_by_username(q, db)
 
 # retrieve all tweets that belongs to this user
+# with a token every tweet says if the logged in user liked it ("liked_by_me")
 @userRouter.get("/{user_id}/tweets")
-async def get_user_tweets(user_id: int, db: Session = Depends(get_db)):
-    return get_tweets_by_user(user_id, db)
+async def get_user_tweets(user_id: int, db: Session = Depends(get_db), viewer = Depends(get_optional_user)):
+    return get_tweets_by_user(user_id, db, viewer.id if viewer else None)
 
 
 # protected delete route - can only delete your own account
@@ -88,21 +107,44 @@ async def delete_user(
 
 # get users the current user is following
 @userRouter.get("/following")
-async def get_my_following(
+def get_my_following(
+    response: Response,
+    before: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """Get one page of the users the current user is following, pass next_cursor back as ?before= for the next one"""
+    page = get_user_following(current_user.id, db, before, limit)
+    set_next_cursor(response, "/api/users/following", page["next_cursor"], limit)
+    return page
+
+# which of the given users the current user follows, e.g. ?ids=4,8,15
+@userRouter.get("/following/status")
+def get_my_following_status(
+    ids: str = Query(..., pattern=r"^\d+(,\d+)*$"),
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
-    """Get list of users the current user is following"""
-    return get_user_following(current_user.id, db)
+    """Get {"following": [ids]}, the ids in ?ids= that the current user follows"""
+    user_ids = [int(user_id) for user_id in ids.split(",")]
+    if len(user_ids) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PAGE_SIZE} ids at a time")
+    return get_following_status(current_user.id, user_ids, db)
 
 # get followers of the current user
 @userRouter.get("/followers")
-async def get_my_followers(
+def get_my_followers(
+    response: Response,
+    before: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
-    """Get list of users following the current user"""
-    return get_user_followers(current_user.id, db)
+    """Get one page of the users following the current user, pass next_cursor back as ?before= for the next one"""
+    page = get_user_followers(current_user.id, db, before, limit)
+    set_next_cursor(response, "/api/users/followers", page["next_cursor"], limit)
+    return page
 
 # Follow a user
 @userRouter.post("/follow/{user_id}")
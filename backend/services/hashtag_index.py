@@ -0,0 +1,100 @@
+import os
+import threading
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models.hashtag_schema import Hashtag, tweet_hashtags
+
+# how many suggestions every prefix keeps ready
+HASHTAG_SUGGEST_LIMIT = int(os.getenv("HASHTAG_SUGGEST_LIMIT", "10"))
+
+class TrieNode:
+    __slots__ = ("children", "top")
+
+    def __init__(self):
+        self.children = {}
+        # the most used hashtags starting with this node's prefix, most used first
+        self.top = []
+
+class HashtagIndex:
+    """
+    In-memory prefix index of hashtag names for autocomplete.
+
+    - a trie on the lowercased names, every node keeps the top_k most used hashtags under it,
+      so a suggestion is one walk down the prefix (O(len(prefix))) and a copy of a short list
+    - record() bumps the count of a hashtag and fixes the top lists on its path, O(len(name) * top_k)
+    - load() rebuilds the whole index from the database in a new trie and swaps it in,
+      readers never see a half-built index
+    - one lock for writers; reads take it only to copy a top list
+    """
+
+    def __init__(self, top_k):
+        self.top_k = top_k
+        self._root = TrieNode()
+        # {lowercased name: [display name, count]}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._counts)
+
+    def suggest(self, prefix, limit=None):
+        """[{"name", "count"}] of the most used hashtags starting with prefix (case-insensitive)"""
+        limit = self.top_k if limit is None else min(limit, self.top_k)
+        with self._lock:
+            node = self._root
+            for char in prefix.lstrip("#").lower():
+                node = node.children.get(char)
+                if node is None:
+                    return []
+            top = node.top[:limit]
+            return [{"name": self._counts[key][0], "count": self._counts[key][1]} for key in top]
+
+    def record(self, name, uses=1):
+        """Count new uses of a hashtag, called by create_tweet"""
+        with self._lock:
+            self._add(self._root, self._counts, name, uses)
+
+    def load(self, db: Session):
+        """Rebuild the index from the hashtags table with their number of tweets, returns the number of hashtags"""
+        rows = (
+            db.query(Hashtag.name, func.count(tweet_hashtags.c.tweet_id))
+            .outerjoin(tweet_hashtags, tweet_hashtags.c.hashtag_id == Hashtag.id)
+            .group_by(Hashtag.id, Hashtag.name)
+            .all()
+        )
+        root, counts = TrieNode(), {}
+        for name, uses in rows:
+            self._add(root, counts, name, uses)
+        with self._lock:
+            self._root, self._counts = root, counts
+        return len(counts)
+
+    def _add(self, root, counts, name, uses):
+        key = name.lower()
+        entry = counts.setdefault(key, [name, 0])
+        entry[1] += uses
+        count = entry[1]
+        if count <= 0:
+            # a hashtag no tweet uses (anymore) is never suggested
+            return
+
+        # the root too, an empty prefix suggests the most used hashtags overall
+        path = [root]
+        for char in key:
+            path.append(path[-1].children.setdefault(char, TrieNode()))
+        for node in path:
+            top = node.top
+            if key in top:
+                top.remove(key)
+            elif len(top) >= self.top_k and counts[top[-1]][1] >= count:
+                # not used enough to make this prefix's top list
+                continue
+            # insert in place, the lists are short
+            position = 0
+            while position < len(top) and counts[top[position]][1] >= count:
+                position += 1
+            top.insert(position, key)
+            del top[self.top_k:]
+
+# the index shared by the whole app, filled at startup (see app.py)
+hashtag_index = HashtagIndex(top_k=HASHTAG_SUGGEST_LIMIT)
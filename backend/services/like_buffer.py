@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from batcher_db import SessionCache, LikeCache, engine_cache
+
+# likes are written to like_cache.db at least this often...
+LIKE_BUFFER_FLUSH_MS = float(os.getenv("LIKE_BUFFER_FLUSH_MS", "100"))
+# ...or as soon as this many likes are waiting
+LIKE_BUFFER_MAX_EVENTS = int(os.getenv("LIKE_BUFFER_MAX_EVENTS", "500"))
+
+def upsert_statement():
+    """INSERT ... ON CONFLICT (tweetId) DO UPDATE SET count = count + excluded.count"""
+    insert = postgresql_insert if engine_cache.dialect.name == "postgresql" else sqlite_insert
+    statement = insert(LikeCache)
+    return statement.on_conflict_do_update(
+        index_elements=[LikeCache.tweetId],
+        set_={"count": LikeCache.count + statement.excluded.count},
+    )
+
+class LikeBuffer:
+    """
+    Sums likes per tweet in memory and moves them to the like_cache.db queue in batches.
+
+    A click used to be one SQLite write transaction (and one disk sync). Now add() is a dict
+    update under a lock, and a background thread writes everything that piled up in one
+    transaction every flush_ms, or earlier when max_events likes are waiting.
+    Likes that are still in memory are lost if the process crashes; close() (called when
+    the app shuts down) writes them out first
+    """
+
+    def __init__(self, flush_ms, max_events):
+        self.flush_seconds = flush_ms / 1000
+        self.max_events = max_events
+        # {tweet_id: likes not written to like_cache.db yet}
+        self._counts = {}
+        # the likes of the flush that is running, still counted by pending() until they are committed
+        self._flushing = {}
+        self._events = 0
+        self._lock = threading.Lock()
+        # serializes flushes, so a close() can't overtake a running flush
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="like-buffer", daemon=True)
+        self._thread.start()
+
+    def add(self, tweet_id, count=1):
+        """Buffer a like (or an unlike, count=-1), returns how many likes of this tweet are buffered now"""
+        with self._lock:
+            buffered = self._counts.get(tweet_id, 0) + count
+            self._counts[tweet_id] = buffered
+            self._events += abs(count)
+            full = self._events >= self.max_events
+        if self._thread is None:
+            # no flusher running (scripts, tests), write through
+            self.flush()
+        elif full:
+            self._wake.set()
+        return buffered
+
+    def pending(self, tweet_ids):
+        """{tweet_id: buffered likes} for the given tweets"""
+        with self._lock:
+            return {
+                tweet_id: self._counts.get(tweet_id, 0) + self._flushing.get(tweet_id, 0)
+                for tweet_id in tweet_ids
+                if tweet_id in self._counts or tweet_id in self._flushing
+            }
+
+    def flush(self):
+        """Write every buffered like to like_cache.db in one transaction, returns how many tweets were written"""
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts = self._counts, {}
+                self._flushing = counts
+                self._events = 0
+            if not counts:
+                return 0
+            now = time.time()
+            cache = SessionCache()
+            try:
+                cache.execute(
+                    upsert_statement(),
+                    [{"tweetId": tweet_id, "count": count, "firstSeenAt": now} for tweet_id, count in counts.items()]
+                )
+                cache.commit()
+            except Exception:
+                cache.rollback()
+                # put the likes back, the next flush tries again
+                with self._lock:
+                    for tweet_id, count in counts.items():
+                        self._counts[tweet_id] = self._counts.get(tweet_id, 0) + count
+                        self._events += abs(count)
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+                cache.close()
+            return len(counts)
+
+    def close(self):
+        """Stop the flusher and write out what is still buffered"""
+        if self._thread is not None:
+            self._stopped.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Flushing likes failed: {e}")
+
+# the buffer shared by the whole app, started and drained by the app lifespan (see app.py)
+like_buffer = LikeBuffer(flush_ms=LIKE_BUFFER_FLUSH_MS, max_events=LIKE_BUFFER_MAX_EVENTS)
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+from models.like_schema import Like
+
+# how many users' likes are kept in memory, the least recently used ones are dropped first
+LIKE_INDEX_MAX_USERS = int(os.getenv("LIKE_INDEX_MAX_USERS", "10000"))
+# seconds before a user's likes are read again, covers likes made through another API instance
+LIKE_INDEX_TTL = float(os.getenv("LIKE_INDEX_TTL", "300"))
+
+class LikeIndex:
+    """
+    Which tweets a user has liked, so a page of tweets can say "liked_by_me" without a query per tweet.
+
+    - every user's liked tweet ids are one sorted array of 32-bit ints (4 bytes per like),
+      loaded with one query on the user's first lookup
+    - liked() answers for a whole page with one binary search per tweet, under one lock
+    - like_tweet/unlike_tweet keep the arrays of loaded users up to date
+    - an array is read again after ttl seconds, and at most max_users arrays are kept (LRU)
+    - like the db cache, a load that started before a like/unlike of that user is not stored
+    """
+
+    def __init__(self, max_users, ttl):
+        self.max_users = max_users
+        self.ttl = ttl
+        # {user_id: (expires_at, sorted array of tweet ids)} in least-recently-used order
+        self._users = OrderedDict()
+        # bumped on every like/unlike, {user_id: generation of their last change}
+        self._generation = 0
+        self._changed_at = {}
+        # _changed_at is reset when it gets big, loads older than that are not stored
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def liked(self, db: Session, user_id: int, tweet_ids) -> set:
+        """The ids in tweet_ids that user_id has liked"""
+        tweet_ids = list(tweet_ids)
+        if not tweet_ids:
+            return set()
+        with self._lock:
+            item = self._users.get(user_id)
+            if item is not None and item[0] > time.monotonic():
+                self._users.move_to_end(user_id)
+                return {tweet_id for tweet_id in tweet_ids if contains(item[1], tweet_id)}
+            since = self._generation
+        tweets = self._load(db, user_id, since)
+        return {tweet_id for tweet_id in tweet_ids if contains(tweets, tweet_id)}
+
+    def add(self, user_id: int, tweet_id: int):
+        """Called after a like is committed"""
+        with self._lock:
+            self._changed(user_id)
+            item = self._users.get(user_id)
+            if item is not None:
+                tweets = item[1]
+                position = bisect_left(tweets, tweet_id)
+                if position == len(tweets) or tweets[position] != tweet_id:
+                    tweets.insert(position, tweet_id)
+
+    def remove(self, user_id: int, tweet_id: int):
+        """Called after an unlike is committed"""
+        with self._lock:
+            self._changed(user_id)
+            item = self._users.get(user_id)
+            if item is not None:
+                tweets = item[1]
+                position = bisect_left(tweets, tweet_id)
+                if position < len(tweets) and tweets[position] == tweet_id:
+                    del tweets[position]
+
+    def forget(self, user_id: int):
+        """Drop a user, e.g. when the account is deleted"""
+        with self._lock:
+            self._changed(user_id)
+            self._users.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "likes": sum(len(tweets) for _, tweets in self._users.values()),
+            }
+
+    def _load(self, db: Session, user_id: int, since: int):
+        rows = db.query(Like.tweetId).filter(Like.user_id == user_id).order_by(Like.tweetId).all()
+        tweets = array("i", (row[0] for row in rows))
+        with self._lock:
+            # a like or unlike of this user happened while reading, the next lookup reads again
+            if since < self._floor or self._changed_at.get(user_id, 0) > since:
+                return tweets
+            self._users[user_id] = (time.monotonic() + self.ttl, tweets)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return tweets
+
+    def _changed(self, user_id):
+        self._generation += 1
+        if len(self._changed_at) > 10 * self.max_users:
+            self._changed_at.clear()
+            self._floor = self._generation
+        self._changed_at[user_id] = self._generation
+
+def contains(tweets, tweet_id) -> bool:
+    position = bisect_left(tweets, tweet_id)
+    return position < len(tweets) and tweets[position] == tweet_id
+
+# the index shared by the whole app
+like_index = LikeIndex(max_users=LIKE_INDEX_MAX_USERS, ttl=LIKE_INDEX_TTL)
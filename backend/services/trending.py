@@ -0,0 +1,142 @@
+import heapq
+import os
+import threading
+import time
+from collections import Counter, deque
+from datetime import timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models.tweet_schema import Tweet
+from models.hashtag_schema import Hashtag, tweet_hashtags
+
+# the windows trending hashtags are ranked over, {name: seconds}
+TRENDING_WINDOWS = {"1h": 3600, "24h": 86400}
+# every window is split into this many buckets, a count leaves the window one bucket at a time
+TRENDING_BUCKETS = int(os.getenv("TRENDING_BUCKETS", "60"))
+# how many hashtags a trending list has at most
+TRENDING_TOP_K = int(os.getenv("TRENDING_TOP_K", "20"))
+# seconds a computed trending list is served before it is computed again
+TRENDING_REFRESH_SECONDS = float(os.getenv("TRENDING_REFRESH_SECONDS", "10"))
+
+class SlidingWindowCounter:
+    """
+    Per-hashtag counts over the last `window` seconds, in time buckets.
+
+    - the window is split into `buckets` buckets of window/buckets seconds, each a Counter
+    - `totals` is the sum of all buckets, kept up to date: a new use adds to it, a bucket
+      that slides out of the window is subtracted from it, so reading the counts never
+      has to add up the buckets
+    - counts are exact to within one bucket at the old end of the window
+    """
+
+    def __init__(self, window, buckets):
+        self.window = window
+        self.buckets = buckets
+        self.bucket_seconds = window / buckets
+        # (bucket number, Counter), oldest first
+        self._buckets = deque()
+        self.totals = Counter()
+
+    def add(self, names, at):
+        bucket = int(at // self.bucket_seconds)
+        if self._buckets and self._buckets[-1][0] == bucket:
+            counts = self._buckets[-1][1]
+        elif self._buckets and self._buckets[-1][0] > bucket:
+            # an older timestamp (loading history), find or skip its bucket
+            counts = next((counts for number, counts in self._buckets if number == bucket), None)
+            if counts is None:
+                return
+        else:
+            counts = Counter()
+            self._buckets.append((bucket, counts))
+        counts.update(names)
+        self.totals.update(names)
+
+    def expire(self, now):
+        """Subtract the buckets that are older than the window"""
+        oldest = int((now - self.window) // self.bucket_seconds)
+        while self._buckets and self._buckets[0][0] <= oldest:
+            _, counts = self._buckets.popleft()
+            self.totals.subtract(counts)
+            for name in counts:
+                if self.totals[name] <= 0:
+                    del self.totals[name]
+
+class TrendingHashtags:
+    """
+    Hashtags ranked by their number of uses over sliding windows (see TRENDING_WINDOWS).
+
+    create_tweet feeds it with record(); top() serves a ranked list that is recomputed at most
+    every refresh_seconds, so a page load costs a dictionary lookup.
+    Counts are per API instance; with requests spread by the load balancer every instance
+    sees the same trends in proportion. load() fills the windows from the database at startup
+    """
+
+    def __init__(self, windows, buckets, top_k, refresh_seconds):
+        self.top_k = top_k
+        self.refresh_seconds = refresh_seconds
+        self._windows = {name: SlidingWindowCounter(seconds, buckets) for name, seconds in windows.items()}
+        # {window name: (computed at, [{"name", "count"}])}
+        self._ranked = {}
+        self._lock = threading.Lock()
+
+    @property
+    def windows(self):
+        return list(self._windows)
+
+    def record(self, names, at=None):
+        """Count one use of every hashtag in names (lowercased, so #Fun and #fun trend together)"""
+        at = time.time() if at is None else at
+        names = [name.lower() for name in names]
+        if not names:
+            return
+        with self._lock:
+            for counter in self._windows.values():
+                counter.add(names, at)
+                # drop the buckets that slid out here too, top() may not be called for a long time
+                counter.expire(at)
+
+    def top(self, window, limit=None):
+        """[{"name", "count"}] of the most used hashtags in the window, most used first"""
+        limit = self.top_k if limit is None else min(limit, self.top_k)
+        now = time.time()
+        with self._lock:
+            ranked = self._ranked.get(window)
+            if ranked is None or now - ranked[0] >= self.refresh_seconds:
+                counter = self._windows[window]
+                counter.expire(now)
+                top = heapq.nlargest(self.top_k, counter.totals.items(), key=lambda item: item[1])
+                ranked = (now, [{"name": name, "count": count} for name, count in top])
+                self._ranked[window] = ranked
+        return ranked[1][:limit]
+
+    def load(self, db: Session):
+        """Replay the hashtags of the tweets inside the longest window, returns how many uses were replayed"""
+        longest = max(counter.window for counter in self._windows.values())
+        # ages are measured on the database clock, tweets.created_at is written by it
+        db_now = db.query(func.now()).scalar().replace(tzinfo=None)
+        rows = (
+            db.query(Tweet.created_at, Hashtag.name)
+            .join(tweet_hashtags, tweet_hashtags.c.tweet_id == Tweet.id)
+            .join(Hashtag, Hashtag.id == tweet_hashtags.c.hashtag_id)
+            .filter(Tweet.created_at >= db_now - timedelta(seconds=longest))
+            .order_by(Tweet.created_at)
+            .all()
+        )
+        windows = {
+            name: SlidingWindowCounter(counter.window, counter.buckets) for name, counter in self._windows.items()
+        }
+        now = time.time()
+        for created_at, name in rows:
+            at = now - (db_now - created_at).total_seconds()
+            for counter in windows.values():
+                counter.add([name.lower()], at)
+        with self._lock:
+            self._windows = windows
+            self._ranked = {}
+        return len(rows)
+
+# the trending counters shared by the whole app, loaded at startup (see app.py)
+trending_hashtags = TrendingHashtags(
+    TRENDING_WINDOWS, TRENDING_BUCKETS, TRENDING_TOP_K, TRENDING_REFRESH_SECONDS
+)
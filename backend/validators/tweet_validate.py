@@ -1,5 +1,9 @@
+from typing import List
 from pydantic import BaseModel, Field
 
+# most tweets one POST /tweets/batch can create
+TWEET_BATCH_MAX = 500
+
 # must include the "content" field as a string
 class TweetCreate(BaseModel):
     # field(...) indicates that this field is required
@@ -7,4 +11,8 @@ class TweetCreate(BaseModel):
 
 # must include the "content" field as a string
 class TweetUpdate(BaseModel):
-    content: str = Field(...)
\ No newline at end of file
+    content: str = Field(...)
+
+# a list of tweets for POST /tweets/batch, between 1 and TWEET_BATCH_MAX of them
+class TweetBatchCreate(BaseModel):
+    tweets: List[TweetCreate] = Field(..., min_length=1, max_length=TWEET_BATCH_MAX)
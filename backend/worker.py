@@ -1,60 +1,167 @@
+import os
 import time
+import uuid
 import threading
-from sqlalchemy import text
-from batcher_db import SessionCache, LikeCache
+from sqlalchemy import table, column, values, update, insert, select, delete, case, literal, func, Integer
+from sqlalchemy.exc import IntegrityError
+from batcher_db import SessionCache, LikeCache, LikeOutbox
 from config.db import SessionLocal
+from deploy import engine
+from models.like_flush_schema import LikeFlush
 
-# The flush_likes function is responsible for moving likes
-# from the cache database into the main database (our postgres)
-def flush_likes():
-    # open a new session for the cache database and the maon database
-    cache = SessionCache()
-    main_db = SessionLocal()
-    # get the current time (in seconds)
-    now = time.time()
-
-    # a query for all LikeCache entries where:
-    # count >= 10: we have a full batch ready or 
-    # now - firstSeenAt >= 60: we have waited long enough
-    batches = (
-        cache.query(LikeCache)
-             .filter(
-                 (LikeCache.count >= 10) |
-                 ((now - LikeCache.firstSeenAt) >= 60)
-             )
-             .all()
+# a tweet's likes are moved once this many are queued...
+LIKE_FLUSH_MIN_COUNT = int(os.getenv("LIKE_FLUSH_MIN_COUNT", "10"))
+# ...or once the oldest of them has waited this many seconds
+LIKE_FLUSH_MAX_AGE = float(os.getenv("LIKE_FLUSH_MAX_AGE", "60"))
+# at most this many tweets per batch, the oldest first; a full batch is followed by the next one right away
+LIKE_FLUSH_MAX_BATCH = int(os.getenv("LIKE_FLUSH_MAX_BATCH", "1000"))
+# the pause between runs starts at the min, doubles every run that finds nothing up to the max,
+# and drops back to the min as soon as a run moves likes
+LIKE_WORKER_POLL_MIN = float(os.getenv("LIKE_WORKER_POLL_MIN", "0.2"))
+LIKE_WORKER_POLL_MAX = float(os.getenv("LIKE_WORKER_POLL_MAX", "5"))
+# tweets are split between workers by tweet id % LIKE_WORKER_SHARDS. Every shard needs exactly one
+# worker thread; LIKE_WORKER_SHARD_IDS lists the ones this process runs (comma separated, all by default),
+# e.g. two containers with LIKE_WORKER_SHARDS=4 and LIKE_WORKER_SHARD_IDS=0,1 / 2,3
+LIKE_WORKER_SHARDS = int(os.getenv("LIKE_WORKER_SHARDS", "1"))
+LIKE_WORKER_SHARD_IDS = [
+    int(shard) for shard in os.getenv("LIKE_WORKER_SHARD_IDS", "").split(",") if shard.strip()
+] or list(range(LIKE_WORKER_SHARDS))
+
+# how long the ids of applied batches are kept, a batch is only ever retried
+# within a few poll intervals so a day is plenty
+LIKE_FLUSH_LOG_RETENTION = float(os.getenv("LIKE_FLUSH_LOG_RETENTION", "86400"))
+
+# only the two columns the worker touches, so it doesn't need the ORM models of the API
+tweets = table("tweets", column("id", Integer), column("likes", Integer))
+
+# The likes go from the cache database to the main database (our postgres) in three steps:
+# 1. claim: the rows that are ready move from like_cache to like_outbox under a new batch id,
+#    in one SQLite transaction. A like that comes in at the same time either is in the batch
+#    or makes a new like_cache row, it can't be lost
+# 2. apply: one bulk UPDATE adds the whole batch to tweets.likes, and the batch id is written to
+#    like_flushes in the same transaction
+# 3. the batch is deleted from like_outbox
+# If the worker dies after 2 but before 3, the batch is still in the outbox and is retried on the
+# next run, like_flushes already has its id so it is not added twice.
+# Every worker only touches the tweets of its shard, so workers never claim the same row
+
+def claim_batch(cache, now, shard=0, shards=1):
+    """
+    Move up to LIKE_FLUSH_MAX_BATCH like_cache rows of the shard that are ready into like_outbox,
+    returns (batch id or None, number of tweets claimed)
+    """
+    batch_id = uuid.uuid4().hex
+    # |count| >= LIKE_FLUSH_MIN_COUNT: we have a full batch ready (unlikes make it negative) or
+    # now - firstSeenAt >= LIKE_FLUSH_MAX_AGE: we have waited long enough
+    # a viral tweet is one row that collects all its likes between two runs, so it never falls behind
+    ready = (
+        select(LikeCache.tweetId)
+        .where(
+            LikeCache.tweetId % shards == shard,
+            (func.abs(LikeCache.count) >= LIKE_FLUSH_MIN_COUNT) | ((now - LikeCache.firstSeenAt) >= LIKE_FLUSH_MAX_AGE)
+        )
+        .order_by(LikeCache.firstSeenAt)
+        .limit(LIKE_FLUSH_MAX_BATCH)
+    )
+    cache.execute(
+        insert(LikeOutbox).from_select(
+            ["batch_id", "tweetId", "count"],
+            select(literal(batch_id), LikeCache.tweetId, LikeCache.count).where(LikeCache.tweetId.in_(ready))
+        )
     )
+    # the INSERT holds the write lock, nothing can change like_cache before this DELETE
+    claimed = select(LikeOutbox.tweetId).where(LikeOutbox.batch_id == batch_id)
+    removed = cache.execute(delete(LikeCache).where(LikeCache.tweetId.in_(claimed))).rowcount
+    cache.commit()
+    return (batch_id if removed else None), removed
 
-    for batch in batches:
-        # increment the likes count on the tweets table
-        # it avoids loading the Tweet ORM and does the update in a single statement
-        main_db.execute(
-            text("UPDATE tweets SET likes = likes + :inc WHERE id = :tweet_id"),
-            {"inc": batch.count, "tweet_id": batch.tweetId}
+def increment_likes(main_db, increments):
+    """Add {tweet_id: count} to tweets.likes in one statement"""
+    if main_db.get_bind().dialect.name == "postgresql":
+        # UPDATE tweets SET likes = likes + v.inc FROM (VALUES (...), ...) AS v (id, inc) WHERE tweets.id = v.id
+        rows = values(column("id", Integer), column("inc", Integer), name="v").data(list(increments.items()))
+        statement = update(tweets).where(tweets.c.id == rows.c.id).values(likes=tweets.c.likes + rows.c.inc)
+    else:
+        # SQLite can't name the columns of a VALUES list, a CASE does the same in one statement
+        statement = (
+            update(tweets)
+            .where(tweets.c.id.in_(list(increments)))
+            .values(likes=tweets.c.likes + case(increments, value=tweets.c.id, else_=0))
         )
-        # remove this from the cache so it wont be processed again
-        cache.delete(batch)
+    main_db.execute(statement)
 
-    # commit the changes to both databases, and close the sessions
-    main_db.commit()
+def apply_batch(cache, main_db, batch_id):
+    """Add a claimed batch to tweets.likes exactly once, then drop it from the outbox"""
+    rows = cache.query(LikeOutbox.tweetId, LikeOutbox.count).filter(LikeOutbox.batch_id == batch_id).all()
+    if rows:
+        try:
+            # the primary key makes a second apply of the same batch fail, and roll back its increments
+            main_db.add(LikeFlush(batch_id=batch_id))
+            main_db.flush()
+            increment_likes(main_db, dict(rows))
+            main_db.commit()
+        except IntegrityError:
+            # applied before the worker stopped last time
+            main_db.rollback()
+    cache.execute(delete(LikeOutbox).where(LikeOutbox.batch_id == batch_id))
     cache.commit()
-    main_db.close()
-    cache.close()
+    return len(rows)
+
+def flush_likes(shard=0, shards=1):
+    """
+    Move the likes of the shard that are ready from the cache database to the main database.
+    Returns (tweets updated, whether the batch was full and more may be ready)
+    """
+    # open a new session for the cache database and the main database
+    cache = SessionCache()
+    main_db = SessionLocal()
+    try:
+        # batches of this shard left over from a run that didn't finish go first
+        leftover = cache.query(LikeOutbox.batch_id).filter(LikeOutbox.tweetId % shards == shard).distinct().all()
+        batch_ids = [row[0] for row in leftover]
+        batch_id, claimed = claim_batch(cache, time.time(), shard, shards)
+        if batch_id:
+            batch_ids.append(batch_id)
+
+        updated = 0
+        for batch_id in batch_ids:
+            updated += apply_batch(cache, main_db, batch_id)
+
+        # forget the ids of old batches
+        cutoff = time.time() - LIKE_FLUSH_LOG_RETENTION
+        main_db.query(LikeFlush).filter(LikeFlush.applied_at < cutoff).delete(synchronize_session=False)
+        main_db.commit()
+        return updated, claimed >= LIKE_FLUSH_MAX_BATCH
+    finally:
+        main_db.close()
+        cache.close()
 
-def run_worker(poll_interval: float = 5.0):
+def run_worker(shard: int = 0, shards: int = 1, poll_min: float = LIKE_WORKER_POLL_MIN, poll_max: float = LIKE_WORKER_POLL_MAX):
     """
-    run flush_likes in an infinite loop, pausing poll_interval seconds between each run
-    poll_interval: how many seconds to sleep between each flush attempt
+    run flush_likes for one shard in an infinite loop
+    poll_min, poll_max: bounds of the pause between two runs, it grows while there is nothing to move
     """
+    poll_interval = poll_min
     while True:
-        # try to flush
-        flush_likes()
-        # wait 5 sec before checking again
+        # try to flush, a failed run leaves its batch in the outbox for the next one
+        try:
+            updated, full = flush_likes(shard, shards)
+        except Exception as e:
+            print(f"Flushing likes of shard {shard} failed: {e}")
+            updated, full = 0, False
+        if full:
+            # more is ready, go again right away
+            continue
+        poll_interval = poll_min if updated else min(poll_interval * 2, poll_max)
         time.sleep(poll_interval)
 
 if __name__ == "__main__":
-    t = threading.Thread(target=run_worker, daemon=True)
-    t.start()
+    # sync_schema creates like_flushes when the API starts, but the worker may be up first
+    LikeFlush.__table__.create(bind=engine, checkfirst=True)
+    # one thread per shard, they only share the SQLite write lock for the short claim transaction
+    for shard in LIKE_WORKER_SHARD_IDS:
+        t = threading.Thread(target=run_worker, args=(shard, LIKE_WORKER_SHARDS), name=f"like-worker-{shard}", daemon=True)
+        t.start()
     try:
         while True:
             time.sleep(1)
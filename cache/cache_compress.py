@@ -0,0 +1,76 @@
+"""
+Precompressed variants of cached bodies.
+
+A body is compressed once when it goes into the cache, every hit just picks the
+variant the client accepts (Accept-Encoding) and sends those bytes as they are.
+gzip is always available, brotli is used if the optional `brotli` package is installed.
+"""
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# bodies smaller than this are not worth compressing (headers + framing eat the gain)
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+CACHE_GZIP_LEVEL = int(os.getenv("CACHE_GZIP_LEVEL", "6"))
+CACHE_BROTLI_QUALITY = int(os.getenv("CACHE_BROTLI_QUALITY", "5"))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml")
+
+# preferred order when the client accepts several with the same q-value
+ENCODING_PREFERENCE = ("br", "gzip")
+
+def is_compressible(content_type, size):
+    return size >= CACHE_COMPRESS_MIN_BYTES and content_type.startswith(COMPRESSIBLE_TYPES)
+
+def compress_variants(body, content_type):
+    """Return {encoding: compressed bytes}, only keeping variants that are actually smaller"""
+    if not is_compressible(content_type, len(body)):
+        return {}
+
+    variants = {}
+    # mtime=0 keeps the output identical for identical bodies
+    gzipped = gzip.compress(body, compresslevel=CACHE_GZIP_LEVEL, mtime=0)
+    if len(gzipped) < len(body):
+        variants["gzip"] = gzipped
+    if brotli is not None:
+        brotlied = brotli.compress(body, quality=CACHE_BROTLI_QUALITY)
+        if len(brotlied) < len(body):
+            variants["br"] = brotlied
+    return variants
+
+def parse_accept_encoding(header):
+    """{encoding: q-value} from an Accept-Encoding header"""
+    accepted = {}
+    for part in (header or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+def choose_encoding(accept_encoding, variants):
+    """Pick the best variant the client accepts, None means send the uncompressed body"""
+    if not variants:
+        return None
+    accepted = parse_accept_encoding(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in ENCODING_PREFERENCE:
+        if encoding not in variants:
+            continue
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
@@ -0,0 +1,89 @@
+"""
+Counters and histograms for the /_cache/metrics endpoint.
+
+Everything here is a plain integer/float update on the request path, the expensive
+parts (hottest keys, percentages) are only computed when the metrics are read.
+"""
+import bisect
+
+# upper bounds of the upstream latency buckets, in milliseconds
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class LatencyHistogram:
+    """Fixed-bucket histogram, like a Prometheus histogram (cumulative counts on read)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        # one count per bucket plus one for everything slower than the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, value_ms):
+        self.counts[bisect.bisect_left(self.buckets, value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets[f"le_{bound}ms"] = cumulative
+        buckets["le_inf"] = self.count
+        return {
+            "count": self.count,
+            "sum_ms": round(self.total_ms, 3),
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "buckets": buckets,
+        }
+
+class CacheMetrics:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # stale entries served while revalidating or because the backend failed
+        self.stale = 0
+        # misses that joined a fetch already running for the same key
+        self.coalesced = 0
+        self.not_modified = 0
+        self.bypassed = 0
+        self.upstream_errors = 0
+        # latency of every backend call, per method ("GET", "POST"...)
+        self.upstream_latency = {}
+
+    def observe_upstream(self, method, elapsed_ms):
+        histogram = self.upstream_latency.get(method)
+        if histogram is None:
+            histogram = self.upstream_latency[method] = LatencyHistogram()
+        histogram.observe(elapsed_ms)
+
+    def snapshot(self, store, breaker, top_n=10):
+        lookups = self.hits + self.stale + self.misses
+        return {
+            "requests": {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "coalesced": self.coalesced,
+                "not_modified": self.not_modified,
+                "bypassed": self.bypassed,
+                "hit_ratio": round((self.hits + self.stale) / lookups, 4) if lookups else 0.0,
+            },
+            "store": {
+                "entries": len(store),
+                "bytes_held": store.bytes_held,
+                "max_bytes": store.max_bytes,
+                "evictions": store.evictions,
+                "expirations": store.expirations,
+                "invalidations": store.invalidations,
+            },
+            "upstream": {
+                "errors": self.upstream_errors,
+                "circuit": breaker.state,
+                "latency": {method: histogram.snapshot() for method, histogram in self.upstream_latency.items()},
+            },
+            "hottest_keys": [
+                {"key": key, "hits": hits, "bytes": size} for key, hits, size in store.hottest(top_n)
+            ],
+        }
@@ -0,0 +1,201 @@
+"""
+Optional second cache tier (L2) on disk, so a cache node comes back warm after a restart.
+
+Uses the same layout as tweet_cache.sqlite:
+    responses(key TEXT PRIMARY KEY, value BLOB, expires INTEGER) + expires_idx on expires
+plus a response_tags(key, tag) table so write-driven invalidation can remove rows by tag.
+
+value holds one cached response: a JSON header line with the metadata, then the raw body
+followed by its compressed variants (their lengths are in the header).
+expires is the wall-clock second (time.time()) after which the row is useless, the
+in-memory tier uses time.monotonic() which does not survive a restart.
+
+All writes and reads go through one background thread that owns the connection, in the
+order they were queued. That keeps SQLite off the event loop, lets puts be grouped into
+one transaction, and makes sure an invalidation can't be overtaken by an older put.
+"""
+import asyncio
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value BLOB, expires INTEGER)",
+    "CREATE INDEX IF NOT EXISTS expires_idx ON responses(expires)",
+    "CREATE TABLE IF NOT EXISTS response_tags (key TEXT NOT NULL, tag TEXT NOT NULL, PRIMARY KEY (tag, key))",
+    "CREATE INDEX IF NOT EXISTS response_tags_key_idx ON response_tags(key)",
+]
+
+def encode_value(cached, tags, fresh_until):
+    """Pack a cached response and its metadata into the value BLOB"""
+    variants = cached.get("variants", {})
+    meta = {
+        "content_type": cached["content_type"],
+        "etag": cached["etag"],
+        "headers": cached.get("headers", {}),
+        "tags": list(tags),
+        "fresh_until": fresh_until,
+        "variants": [[encoding, len(data)] for encoding, data in variants.items()],
+    }
+    parts = [json.dumps(meta).encode("utf-8"), b"\n", cached["body"]]
+    parts.extend(variants.values())
+    return b"".join(parts)
+
+def decode_value(value):
+    """Reverse of encode_value, returns (cached, tags, fresh_until)"""
+    header, payload = bytes(value).split(b"\n", 1)
+    meta = json.loads(header)
+    # the variants are at the end, the body is whatever comes before them
+    variants = {}
+    end = len(payload)
+    for encoding, length in reversed(meta.get("variants", [])):
+        variants[encoding] = payload[end - length:end]
+        end -= length
+    cached = {
+        "body": payload[:end],
+        "content_type": meta["content_type"],
+        "etag": meta["etag"],
+        "headers": meta.get("headers", {}),
+        "variants": variants,
+    }
+    return cached, tuple(meta["tags"]), meta["fresh_until"]
+
+class PersistentCache:
+    def __init__(self, path, batch_size=256):
+        self.path = path
+        self.batch_size = batch_size
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL keeps readers and the writer out of each other's way, NORMAL is enough for a cache
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+        self._conn.commit()
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="cache-l2-writer", daemon=True)
+        self._thread.start()
+
+    # --- called from the event loop -------------------------------------------------
+
+    def put(self, key, cached, tags, fresh_until, expires):
+        """Write a response through to disk, fresh_until and expires are wall-clock times"""
+        self._queue.put(("put", key, encode_value(cached, tags, fresh_until), int(expires) + 1, tuple(tags)))
+
+    def delete_tags(self, tags):
+        self._queue.put(("delete_tags", tuple(tags)))
+
+    def clear(self):
+        self._queue.put(("clear",))
+
+    def prune(self):
+        """Drop expired rows, a range scan on expires_idx"""
+        self._queue.put(("prune",))
+
+    async def get(self, key):
+        """Look a key up on disk, returns (cached, tags, fresh_until, expires) or None"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put(("get", key, loop, future))
+        return await future
+
+    def load(self):
+        """
+        Yield every unexpired row, the ones that stay valid the longest first.
+        Only used at startup, before the writer thread has any work
+        """
+        rows = self._conn.execute(
+            "SELECT key, value, expires FROM responses WHERE expires > ? ORDER BY expires DESC",
+            (int(time.time()),),
+        )
+        for key, value, expires in rows:
+            try:
+                cached, tags, fresh_until = decode_value(value)
+            except (ValueError, KeyError):
+                # not written by us (or from an older version), it will be overwritten or pruned
+                continue
+            yield key, cached, tags, fresh_until, expires
+
+    def close(self):
+        """Finish everything that is queued, then close the file"""
+        self._queue.put(None)
+        self._thread.join()
+        self._conn.close()
+
+    # --- writer thread --------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            op = self._queue.get()
+            if op is None:
+                return
+            batch = [op]
+            # group whatever else is already waiting into the same transaction
+            while len(batch) < self.batch_size:
+                try:
+                    op = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if op is None:
+                    self._apply(batch)
+                    return
+                batch.append(op)
+            self._apply(batch)
+
+    def _apply(self, batch):
+        try:
+            for op in batch:
+                getattr(self, "_op_" + op[0])(*op[1:])
+            self._conn.commit()
+        except sqlite3.Error as e:
+            self._conn.rollback()
+            print(f"Cache L2 write failed: {e}")
+
+    def _op_put(self, key, value, expires, tags):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, expires) VALUES (?, ?, ?)",
+            (key, value, expires),
+        )
+        self._conn.execute("DELETE FROM response_tags WHERE key = ?", (key,))
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO response_tags (key, tag) VALUES (?, ?)",
+            [(key, tag) for tag in tags],
+        )
+
+    def _op_delete_tags(self, tags):
+        for tag in tags:
+            keys = [row[0] for row in self._conn.execute("SELECT key FROM response_tags WHERE tag = ?", (tag,))]
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in keys])
+            self._conn.executemany("DELETE FROM response_tags WHERE key = ?", [(key,) for key in keys])
+
+    def _op_clear(self):
+        self._conn.execute("DELETE FROM responses")
+        self._conn.execute("DELETE FROM response_tags")
+
+    def _op_prune(self):
+        now = int(time.time())
+        self._conn.execute(
+            "DELETE FROM response_tags WHERE key IN (SELECT key FROM responses WHERE expires <= ?)", (now,)
+        )
+        self._conn.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+
+    def _op_get(self, key, loop, future):
+        result = None
+        try:
+            row = self._conn.execute(
+                "SELECT value, expires FROM responses WHERE key = ? AND expires > ?",
+                (key, int(time.time())),
+            ).fetchone()
+            if row is not None:
+                cached, tags, fresh_until = decode_value(row[0])
+                result = (cached, tags, fresh_until, row[1])
+        except (sqlite3.Error, ValueError, KeyError) as e:
+            print(f"Cache L2 read of {key} failed: {e}")
+        loop.call_soon_threadsafe(_resolve, future, result)
+
+def _resolve(future, result):
+    # the waiting request may have been cancelled in the meantime
+    if not future.done():
+        future.set_result(result)
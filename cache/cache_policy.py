@@ -0,0 +1,50 @@
+"""
+Per-route freshness policy for cached GETs.
+
+- ttl: seconds a response is fresh and served straight from the cache
+- stale_while_revalidate: seconds after that where the stale response is still served
+  immediately while a background fetch refreshes it, so no client waits on the backend
+  when an entry expires
+- stale_if_error: seconds after ttl where the stale response is served if the backend
+  fails or the circuit breaker is open, instead of returning an error
+
+Paths are matched without the leading "/" and the query string, like in cache_tags.py.
+"""
+import os
+import re
+
+class RoutePolicy:
+    __slots__ = ("ttl", "stale_while_revalidate", "stale_if_error")
+
+    def __init__(self, ttl, stale_while_revalidate, stale_if_error):
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+
+    @property
+    def stale_ttl(self):
+        """How long an entry is kept after it stopped being fresh"""
+        return max(self.stale_while_revalidate, self.stale_if_error)
+
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "60"))
+CACHE_STALE_WHILE_REVALIDATE = float(os.getenv("CACHE_STALE_WHILE_REVALIDATE", "30"))
+CACHE_STALE_IF_ERROR = float(os.getenv("CACHE_STALE_IF_ERROR", "300"))
+
+DEFAULT_POLICY = RoutePolicy(CACHE_TTL_SECONDS, CACHE_STALE_WHILE_REVALIDATE, CACHE_STALE_IF_ERROR)
+
+# the first matching rule wins, everything else uses DEFAULT_POLICY
+ROUTE_POLICIES = [
+    # search results change slowly and are expensive, a minute of extra staleness is fine
+    (re.compile(r"^api/(tweets|tweets/hashtag|users)/search/?$"),
+     RoutePolicy(CACHE_TTL_SECONDS, 2 * CACHE_TTL_SECONDS, CACHE_STALE_IF_ERROR)),
+    # follower counts are only shown as numbers on profiles
+    (re.compile(r"^api/users/\d+/(followers|following)/count/?$"),
+     RoutePolicy(CACHE_TTL_SECONDS, 2 * CACHE_TTL_SECONDS, CACHE_STALE_IF_ERROR)),
+]
+
+def route_policy(path):
+    path = path.lstrip("/")
+    for pattern, policy in ROUTE_POLICIES:
+        if pattern.match(path):
+            return policy
+    return DEFAULT_POLICY
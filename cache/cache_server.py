@@ -1,10 +1,77 @@
-from fastapi import FastAPI, Request, Response
+from fastapi import FastAPI, HTTPException, Request, Response
 import httpx  # Modern async HTTP client
+import asyncio
+import hashlib
+import hmac
 import json
-from datetime import datetime, timedelta
+import os
+import time
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
+from cache_store import CacheStore
+from cache_tags import read_tags, write_tags
+from cache_policy import CACHE_TTL_SECONDS, route_policy
+from circuit_breaker import CircuitBreaker
+from cache_persist import PersistentCache
+from cache_compress import compress_variants, choose_encoding
+from cache_metrics import CacheMetrics
 
-app = FastAPI()
+# where the API lives, docker-compose sets this for every cache container
+BACKEND_URL = os.getenv("BACKEND_URL", "http://backend:8000").rstrip("/")
+
+# upstream connection pool settings, tunable per container through the environment
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "2"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "10"))
+# HTTP/2 needs the h2 package (installed via httpx[http2]) and an upstream that speaks it
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# one long-lived client shared by all requests, so connections to the backend are reused
+# instead of opening a new TCP connection on every cache miss
+upstream_client = None
+
+def create_upstream_client():
+    """Build the pooled keep-alive client used to talk to the backend"""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            UPSTREAM_READ_TIMEOUT,
+            connect=UPSTREAM_CONNECT_TIMEOUT,
+        ),
+        http2=UPSTREAM_HTTP2,
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Open the upstream client (and the on-disk tier, if configured) when the app starts
+    and close them on shutdown
+    """
+    global upstream_client, l2_cache
+    upstream_client = create_upstream_client()
+    prune_task = None
+    if CACHE_L2_PATH:
+        l2_cache = PersistentCache(CACHE_L2_PATH)
+        warm_from_l2()
+        prune_task = asyncio.ensure_future(prune_l2_periodically())
+    try:
+        yield
+    finally:
+        if prune_task is not None:
+            prune_task.cancel()
+        if l2_cache is not None:
+            l2_cache.close()
+            l2_cache = None
+        await upstream_client.aclose()
+        upstream_client = None
+
+app = FastAPI(lifespan=lifespan)
 
 # need to have cors middelware because of cors issues when trying to access backedn through caches first
 app.add_middleware(
@@ -13,96 +80,401 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Link", "X-Next-Cursor"],  # pagination cursor for the frontend
 )
 
-# chose in-memory cache storage: {url_string: {"data": response_data, "timestamp": datetime_object}} instead of redis or another mehtods for caching
-cache = {}
+# chose in-memory cache storage instead of redis or another mehtods for caching
+# the store is bounded by a byte budget and an entry count, and least recently used entries are evicted first
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
 
-def check_invalidation():
-    """Remove cache entries older than 1 minute
-    and returns the number og entries removed """
-    now = datetime.now()
-    expired_keys = []
-    
-    for url in list(cache.keys()):
-        cache_time = cache[url]["timestamp"]
-        if now - cache_time > timedelta(minutes=1):
-            expired_keys.append(url)
-    
-    # this is where removal of expired entities happen
-    for url in expired_keys:
-        del cache[url]
-        
-    print(f"Cache invalidation removed {len(expired_keys)} entries")
-    
-    return len(expired_keys)
+cache = CacheStore(
+    max_bytes=CACHE_MAX_BYTES,
+    max_entries=CACHE_MAX_ENTRIES,
+    default_ttl=CACHE_TTL_SECONDS,
+)
+
+# optional on-disk tier (same layout as tweet_cache.sqlite), every cached response is written
+# through to it so the node comes back warm after a restart; empty means memory only
+CACHE_L2_PATH = os.getenv("CACHE_L2_PATH", "")
+CACHE_L2_PRUNE_INTERVAL = float(os.getenv("CACHE_L2_PRUNE_INTERVAL", "60"))
+
+l2_cache = None
+
+def to_wall_clock(monotonic_time):
+    """Convert a time.monotonic() timestamp to time.time(), for what is stored on disk"""
+    return time.time() + (monotonic_time - time.monotonic())
+
+def store_from_l2(key, cached, tags, fresh_until, expires):
+    """Put a response read from disk back into memory, keeping its remaining fresh and stale time"""
+    now = time.time()
+    return cache.set(
+        key, cached, size=cached_size(cached), ttl=fresh_until - now,
+        tags=tags, stale_ttl=expires - max(fresh_until, now)
+    )
+
+def warm_from_l2():
+    """Fill the memory tier from disk at startup, the entries that stay valid the longest first"""
+    loaded = 0
+    for key, cached, tags, fresh_until, expires in l2_cache.load():
+        if cache.bytes_held + cached_size(cached) > cache.max_bytes or len(cache) >= cache.max_entries:
+            break
+        store_from_l2(key, cached, tags, fresh_until, expires)
+        loaded += 1
+    print(f"Cache L2 warm start: loaded {loaded} entries from {CACHE_L2_PATH}")
+
+async def prune_l2_periodically():
+    """Remove expired rows from disk every CACHE_L2_PRUNE_INTERVAL seconds"""
+    while True:
+        l2_cache.prune()
+        await asyncio.sleep(CACHE_L2_PRUNE_INTERVAL)
+
+async def lookup(cache_key, tags):
+    """Find a cached entry in memory, or on disk if it was evicted from memory or the node restarted"""
+    entry = cache.get(cache_key)
+    if entry is not None or l2_cache is None:
+        return entry
+    versions = cache.tag_versions(tags)
+    row = await l2_cache.get(cache_key)
+    # a write that happened while we were reading the disk wins
+    if row is None or cache.tag_versions(tags) != versions:
+        return None
+    return store_from_l2(cache_key, *row)
+
+# the other cache nodes, writes are broadcast to them so they evict the same tags
+# e.g. CACHE_PEERS=http://cache2:8001,http://cache3:8001
+CACHE_PEERS = [peer.strip().rstrip("/") for peer in os.getenv("CACHE_PEERS", "").split(",") if peer.strip()]
+# shared secret of the nodes, /_cache/* only answers requests that send it in X-Cache-Peer-Token
+# (the node ports are published, so nginx is not the only way in). Empty leaves /_cache/* open
+CACHE_PEER_TOKEN = os.getenv("CACHE_PEER_TOKEN", "")
+PEER_TOKEN_HEADER = "X-Cache-Peer-Token"
+
+metrics = CacheMetrics()
+
+# stop calling the backend after this many failures in a row, try again after the timeout
+UPSTREAM_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "5"))
+UPSTREAM_RESET_TIMEOUT = float(os.getenv("UPSTREAM_RESET_TIMEOUT", "10"))
+
+breaker = CircuitBreaker(
+    failure_threshold=UPSTREAM_FAILURE_THRESHOLD,
+    reset_timeout=UPSTREAM_RESET_TIMEOUT,
+)
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling the backend while the circuit breaker is open"""
+
+# backend fetches that are currently running, {cache_key: asyncio.Task}
+# concurrent misses for the same key wait on the same task instead of each one calling the backend
+in_flight = {}
+
+# headers that describe one connection or the encoding of one message, they are not passed
+# through (httpx already decoded the body, so the upstream length/encoding no longer apply)
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te",
+    "trailer", "transfer-encoding", "upgrade", "content-length", "content-encoding",
+}
+
+# headers of a backend response that are part of the data and are cached with the body,
+# e.g. the cursor of the next page of a paginated list
+CACHED_HEADERS = {"link", "x-next-cursor"}
+
+# conditional headers belong to the client's copy, a cache fill always needs the full body
+CONDITIONAL_HEADERS = {"if-none-match", "if-modified-since"}
+
+def forward_headers(request: Request, drop=()):
+    """Copy the incoming headers, without 'host' to avoid conflicts with the backend"""
+    headers = dict(request.headers)
+    if "host" in headers:
+        del headers["host"]
+    for name in drop:
+        headers.pop(name, None)
+    return headers
+
+def response_headers(response):
+    """Headers of a backend response that can be passed on to the client"""
+    return {
+        name: value for name, value in response.headers.items()
+        if name.lower() not in HOP_BY_HOP_HEADERS
+    }
+
+def make_etag(body):
+    """Strong ETag derived from the exact response bytes"""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match, etag):
+    """
+    True if the If-None-Match header lists the etag (or is "*").
+    If-None-Match uses the weak comparison, so a W/ prefix is ignored
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+def cached_size(cached):
+    """Bytes a cached response takes, the body plus every compressed variant"""
+    return len(cached["body"]) + sum(len(variant) for variant in cached.get("variants", {}).values())
+
+def cached_response(request: Request, cached, cache_status):
+    """
+    Serve a cached body exactly as it was stored, no re-encoding or compression per hit.
+    The precompressed variant the client accepts is picked by Accept-Encoding.
+    Answers 304 Not Modified when the client already has this version
+    """
+    variants = cached.get("variants", {})
+    encoding = choose_encoding(request.headers.get("accept-encoding"), variants)
+    # every encoding is a different byte sequence, so it needs its own strong ETag
+    etag = cached["etag"] if encoding is None else cached["etag"][:-1] + "-" + encoding + '"'
+    headers = {
+        "ETag": etag,
+        # let browsers keep the body but revalidate with If-None-Match every time
+        "Cache-Control": "no-cache",
+        "X-Cache": cache_status,
+    }
+    headers.update(cached.get("headers", {}))
+    if variants:
+        headers["Vary"] = "Accept-Encoding"
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        metrics.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    if encoding is None:
+        body = cached["body"]
+    else:
+        body = variants[encoding]
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, status_code=200, headers=headers, media_type=cached["content_type"])
+
+async def upstream_request(method, url, **kwargs):
+    """
+    Send one request to the backend through the circuit breaker.
+    Connection errors, timeouts and 5xx answers count as failures
+    """
+    if not breaker.allow_request():
+        raise UpstreamUnavailable("backend unavailable (circuit open)")
+    started = time.perf_counter()
+    try:
+        response = await upstream_client.request(method, url, **kwargs)
+    except httpx.HTTPError:
+        breaker.record_failure()
+        metrics.upstream_errors += 1
+        raise
+    except BaseException:
+        # a cancelled request or a bug on our side says nothing about the backend, it only
+        # ends a half-open trial, otherwise the breaker would wait for it forever and stay open
+        breaker.release_trial()
+        raise
+    finally:
+        metrics.observe_upstream(method, (time.perf_counter() - started) * 1000)
+    if response.status_code >= 500:
+        breaker.record_failure()
+        metrics.upstream_errors += 1
+    else:
+        breaker.record_success()
+    return response
+
+async def fetch_and_cache(cache_key, backend_url, headers, tags, policy):
+    """
+    Send a GET to the backend and cache the raw body if it is a successful response.
+    Returns (response, cached) where cached is the stored {"body", "content_type", "etag", "headers", "variants"}
+    or None if the response can't be cached
+    """
+    # remember the tag versions before asking the backend, if a write invalidates one of
+    # the tags while we wait, the answer may already be stale and is not stored
+    versions = cache.tag_versions(tags)
+    response = await upstream_request("GET", backend_url, headers=headers)
+
+    if response.status_code != 200:
+        return response, None
+
+    body = response.content
+    content_type = response.headers.get("content-type", "application/json")
+    cached = {
+        "body": body,
+        "content_type": content_type,
+        "etag": make_etag(body),
+        "headers": {
+            name: value for name, value in response.headers.items() if name.lower() in CACHED_HEADERS
+        },
+        # compressed once per fill, off the event loop, never per hit
+        "variants": await asyncio.to_thread(compress_variants, body, content_type),
+    }
+    if cache.tag_versions(tags) == versions:
+        # the body and its variants are what counts against the memory budget
+        entry = cache.set(
+            cache_key, cached, size=cached_size(cached), ttl=policy.ttl, tags=tags, stale_ttl=policy.stale_ttl
+        )
+        if entry is not None and l2_cache is not None:
+            l2_cache.put(
+                cache_key, cached, tags,
+                to_wall_clock(entry.fresh_until), to_wall_clock(entry.expires_at)
+            )
+    return response, cached
+
+async def coalesced_fetch(cache_key, backend_url, headers, tags, policy):
+    """
+    Single-flight wrapper around fetch_and_cache: the first miss for a key starts the
+    backend request, every other miss that arrives while it is running awaits the same task
+    """
+    task = in_flight.get(cache_key)
+    if task is not None:
+        metrics.coalesced += 1
+    else:
+        task = asyncio.ensure_future(fetch_and_cache(cache_key, backend_url, headers, tags, policy))
+        in_flight[cache_key] = task
+
+        def _done(finished_task):
+            # only remove our own task, a newer fetch may already have taken the slot
+            if in_flight.get(cache_key) is finished_task:
+                del in_flight[cache_key]
+
+        task.add_done_callback(_done)
+
+    # shield so a client that disconnects does not cancel the fetch the others are waiting on
+    return await asyncio.shield(task)
+
+async def refresh_in_background(cache_key, backend_url, headers, tags, policy):
+    """Revalidate a stale entry after it was served, errors just leave the stale entry in place"""
+    try:
+        await coalesced_fetch(cache_key, backend_url, headers, tags, policy)
+    except Exception as e:
+        print(f"Background refresh of {cache_key} failed: {e}")
+
+def invalidate_local(tags):
+    """Evict the tags from this node, None means clear everything"""
+    # misses arriving after the write must not join a fetch that started before it
+    in_flight.clear()
+    if tags is None:
+        if l2_cache is not None:
+            l2_cache.clear()
+        return cache.clear()
+    if l2_cache is not None:
+        l2_cache.delete_tags(tags)
+    return cache.invalidate_tags(tags)
+
+async def broadcast_invalidation(tags):
+    """Tell the peer cache nodes to evict the same tags, a peer that is down just misses it and relies on its TTL"""
+    payload = {"tags": None if tags is None else list(tags)}
+    for peer in CACHE_PEERS:
+        try:
+            await upstream_client.post(
+                f"{peer}/_cache/invalidate", json=payload, headers={PEER_TOKEN_HEADER: CACHE_PEER_TOKEN}
+            )
+        except httpx.HTTPError as e:
+            print(f"Cache invalidation broadcast to {peer} failed: {e}")
+
+def check_peer_token(request: Request):
+    """Refuse /_cache/* requests that don't carry CACHE_PEER_TOKEN"""
+    sent = request.headers.get(PEER_TOKEN_HEADER, "").encode()
+    if CACHE_PEER_TOKEN and not hmac.compare_digest(sent, CACHE_PEER_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid cache peer token")
+
+# hit ratio, latency and memory of this node, must be registered before the catch-all route below
+@app.get("/_cache/metrics")
+async def handle_metrics(request: Request, top: int = 10):
+    check_peer_token(request)
+    return metrics.snapshot(cache, breaker, top_n=top)
+
+# called by the peer nodes, must be registered before the catch-all route below
+@app.post("/_cache/invalidate")
+async def handle_invalidate(request: Request):
+    check_peer_token(request)
+    payload = await request.json()
+    removed = invalidate_local(payload.get("tags"))
+    return {"removed": removed}
 
 """
     Main request handler that implements caching logic:
     1. For GET requests: Check cache first, forward to backend if not cached
+       (concurrent misses for the same URL share one backend request)
     2. For non-GET requests: Forward directly to backend (no caching)
-    3. Cache successful GET responses for future requests
+    3. Cache successful GET responses for future requests, tagged by route
+       (stale entries are served while they refresh in the background, and when the backend fails)
+    4. Successful writes evict the tags they affect here and on the peer nodes
 """
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def handle_request(request: Request, path: str):
     method = request.method
-    backend_url = f"http://backend:8000/{path}"
+    backend_url = f"{BACKEND_URL}/{path}"
     
     # Add query parameters if any
     if request.query_params:
         backend_url += "?" + str(request.url.query)
     
-    # Only attempt to use cache for GET requests (reads, not writes)
-    if method == "GET":
-        check_invalidation()
-        
-        cache_key = str(request.url)
-        
-        # If in cache and not expired (less than 1 minute old)
-        if cache_key in cache:
-            print(f"Cache HIT: {cache_key}")
-            return cache[cache_key]["data"]
-        
-        #else print this: 
-        print(f"Cache MISS: {cache_key}")
-    
-    # Forward the request to backend API server
     try:
-        # Prepare headers (remove 'host' to avoid conflicts)
-        headers = dict(request.headers)
-        if "host" in headers:
-            del headers["host"]
-        
-        # Get request body for non-GET requests
-        body = await request.body()
-        
-        # Forward request to backend server
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
-                method=method,
-                url=backend_url,
-                headers=headers,
-                content=body
-            )
-        
-        # If GET request and successful, cache the response
-        if method == "GET" and response.status_code == 200:
+        # Only attempt to use cache for GET requests (reads, not writes)
+        # responses to authenticated GETs (/me, /following...) belong to one user and are not shared
+        if method == "GET" and "authorization" not in request.headers:
+            cache_key = str(request.url)
+            
+            policy = route_policy(path)
+            tags = read_tags(path)
+            headers = forward_headers(request, drop=CONDITIONAL_HEADERS)
+
+            # If in cache and still fresh
+            entry = await lookup(cache_key, tags)
+            if entry is not None and entry.is_fresh():
+                metrics.hits += 1
+                return cached_response(request, entry.data, "HIT")
+
+            # stale but inside the stale-while-revalidate window: answer now, refresh in the background
+            if entry is not None and entry.stale_for() <= policy.stale_while_revalidate:
+                metrics.stale += 1
+                if cache_key not in in_flight:
+                    asyncio.ensure_future(refresh_in_background(cache_key, backend_url, headers, tags, policy))
+                return cached_response(request, entry.data, "STALE")
+
+            metrics.misses += 1
+
             try:
-                data = response.json()
-                cache[str(request.url)] = {
-                    "data": data,
-                    "timestamp": datetime.now()
-                }
-                return data
-            except:
-                # Not JSON, don't cache
-                pass
+                response, cached = await coalesced_fetch(cache_key, backend_url, headers, tags, policy)
+            except (httpx.HTTPError, UpstreamUnavailable):
+                # backend down: the last good answer is better than an error
+                if entry is not None and entry.stale_for() <= policy.stale_if_error:
+                    metrics.stale += 1
+                    return cached_response(request, entry.data, "STALE")
+                raise
+            if cached is not None:
+                return cached_response(request, cached, "MISS")
+            if response.status_code >= 500 and entry is not None and entry.stale_for() <= policy.stale_if_error:
+                metrics.stale += 1
+                return cached_response(request, entry.data, "STALE")
+        else:
+            metrics.bypassed += 1
+            # Forward everything else to the backend server over the shared pooled client
+            response = await upstream_request(
+                method,
+                backend_url,
+                headers=forward_headers(request),
+                content=await request.body()
+            )
+
+            # a write that went through evicts the cached reads it made stale
+            if method != "GET" and response.status_code < 400:
+                tags = write_tags(method, path)
+                if tags is None or tags:
+                    invalidate_local(tags)
+                    asyncio.ensure_future(broadcast_invalidation(tags))
         
          # Return the backend response as-is for non-cached responses
         return Response(
             content=response.content,
             status_code=response.status_code,
-            headers=dict(response.headers)
+            headers=response_headers(response)
+        )
+    except UpstreamUnavailable as e:
+        # fail fast while the backend is known to be down
+        return Response(
+            content=json.dumps({"error": str(e)}),
+            status_code=503,
+            media_type="application/json",
+            headers={"Retry-After": str(int(UPSTREAM_RESET_TIMEOUT))}
         )
     except Exception as e:
         # Return a formatted error response if request fails
@@ -0,0 +1,180 @@
+import heapq
+import time
+from collections import OrderedDict
+
+class CacheEntry:
+    """One cached response plus the bookkeeping the store needs to bound and expire it"""
+    __slots__ = ("data", "size", "fresh_until", "expires_at", "tags", "hits")
+
+    def __init__(self, data, size, fresh_until, expires_at, tags=()):
+        self.data = data
+        self.size = size
+        # until fresh_until the entry is served as-is, between fresh_until and expires_at
+        # it is stale but kept so it can still be served while revalidating or on errors
+        self.fresh_until = fresh_until
+        self.expires_at = expires_at
+        self.tags = tags
+        # how often this entry was read, for the hottest keys in the metrics
+        self.hits = 0
+
+    def is_fresh(self):
+        return time.monotonic() < self.fresh_until
+
+    def stale_for(self):
+        """Seconds since the entry stopped being fresh, 0 if it is still fresh"""
+        return max(0.0, time.monotonic() - self.fresh_until)
+
+class CacheStore:
+    """
+    Memory-bounded LRU store for cached responses.
+
+    - entries are kept in an OrderedDict in least-recently-used order, so a hit and an
+      eviction are both O(1)
+    - the store never holds more than max_bytes of response bodies or max_entries keys,
+      the least recently used entries are evicted to make room
+    - expiry times go into a min-heap, so removing expired entries only touches the ones
+      that actually expired instead of scanning every key; entries are also checked
+      lazily when they are read
+    - every entry can carry tags (e.g. "tweets"), a write invalidates a tag and every
+      entry with that tag is removed; each tag also has a version number that is bumped
+      on invalidation, so a fill that started before a write can tell it is outdated
+
+    Times come from time.monotonic() so clock changes on the host can't expire
+    (or resurrect) everything at once.
+    """
+
+    def __init__(self, max_bytes, max_entries, default_ttl):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.bytes_held = 0
+        self._entries = OrderedDict()
+        # (expires_at, key) pairs, may contain stale pairs for keys that were overwritten or evicted
+        self._expiry_heap = []
+        # {tag: set of keys} and {tag: version}
+        self._tag_index = {}
+        self._tag_versions = {}
+        # bumped by clear(), which invalidates every tag at once
+        self._epoch = 0
+        # why entries left the store, for the metrics endpoint
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached entry for key (fresh or stale), or None if missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        # mark as most recently used
+        self._entries.move_to_end(key)
+        entry.hits += 1
+        return entry
+
+    def set(self, key, data, size, ttl=None, tags=(), stale_ttl=0):
+        """
+        Store data under key, evicting expired and then least recently used entries to stay in budget.
+        The entry is fresh for ttl seconds and then kept stale for stale_ttl more seconds
+        """
+        # a single response bigger than the whole budget is never cached
+        if size > self.max_bytes:
+            self.delete(key)
+            return None
+
+        ttl = self.default_ttl if ttl is None else ttl
+        fresh_until = time.monotonic() + ttl
+        expires_at = fresh_until + stale_ttl
+
+        if key in self._entries:
+            self._remove(key)
+
+        entry = CacheEntry(data, size, fresh_until, expires_at, tuple(tags))
+        self._entries[key] = entry
+        self.bytes_held += size
+        for tag in entry.tags:
+            self._tag_index.setdefault(tag, set()).add(key)
+        heapq.heappush(self._expiry_heap, (expires_at, key))
+
+        self.purge_expired()
+        while self.bytes_held > self.max_bytes or len(self._entries) > self.max_entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+        return entry
+
+    def delete(self, key):
+        """Remove key from the store, returns True if it was there"""
+        if key in self._entries:
+            self._remove(key)
+            return True
+        return False
+
+    def tag_versions(self, tags):
+        """Snapshot of the current version of each tag, compare two snapshots to detect an invalidation in between"""
+        return (self._epoch,) + tuple(self._tag_versions.get(tag, 0) for tag in tags)
+
+    def invalidate_tags(self, tags):
+        """Remove every entry carrying one of the tags and returns how many were removed"""
+        removed = 0
+        for tag in tags:
+            self._tag_versions[tag] = self._tag_versions.get(tag, 0) + 1
+            for key in list(self._tag_index.get(tag, ())):
+                if self.delete(key):
+                    removed += 1
+        self.invalidations += removed
+        return removed
+
+    def clear(self):
+        """Drop every entry, used when a write can't be mapped to specific tags"""
+        self._epoch += 1
+        removed = len(self._entries)
+        self.invalidations += removed
+        self._entries.clear()
+        self._tag_index.clear()
+        self._expiry_heap = []
+        self.bytes_held = 0
+        return removed
+
+    def purge_expired(self):
+        """Pop every expired entry off the heap and returns how many were removed"""
+        now = time.monotonic()
+        removed = 0
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry_heap)
+            entry = self._entries.get(key)
+            # skip heap pairs left behind by an overwrite or an eviction
+            if entry is not None and entry.expires_at == expires_at:
+                self._remove(key)
+                removed += 1
+        self.expirations += removed
+
+        # keep the heap from filling up with dead pairs when keys are rewritten a lot
+        if len(self._expiry_heap) > 2 * len(self._entries) + 64:
+            self._expiry_heap = [(entry.expires_at, key) for key, entry in self._entries.items()]
+            heapq.heapify(self._expiry_heap)
+
+        return removed
+
+    def hottest(self, n):
+        """The n most read keys as (key, hits, size), only computed when the metrics are requested"""
+        top = heapq.nlargest(n, self._entries.items(), key=lambda item: item[1].hits)
+        return [(key, entry.hits, entry.size) for key, entry in top]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.bytes_held -= entry.size
+        for tag in entry.tags:
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+        return entry
@@ -0,0 +1,63 @@
+"""
+Tags tie cached GET responses to the writes that make them stale.
+
+Every cacheable GET path gets one or more tags when it is stored. When a write
+(POST/PUT/PATCH/DELETE) goes through the cache server, its path is mapped to the tags
+it affects and every cached entry with one of those tags is evicted, on this node and
+on the peer nodes. This lets cached reads live much longer than a short TTL allows
+without serving stale timelines.
+
+Paths are matched without the leading "/" and the query string, e.g. "api/tweets/search".
+"""
+import re
+
+# tags for cacheable GETs, the first matching rule wins
+READ_RULES = [
+    # tweets of one user are part of the tweet data
+    (re.compile(r"^api/users/\d+/tweets/?$"), ("tweets",)),
+    # follower/following counts
+    (re.compile(r"^api/users/\d+/(followers|following)/count/?$"), ("follows",)),
+    # user search results include follower/following counts
+    (re.compile(r"^api/users/search/?$"), ("users", "follows")),
+    (re.compile(r"^api/users(/.*)?$"), ("users",)),
+    # feed, search, hashtags, likes
+    (re.compile(r"^api/tweets(/.*)?$"), ("tweets",)),
+]
+
+# tags evicted by writes, (methods, path pattern, tags), the first matching rule wins
+WRITE_RULES = [
+    # login/logout don't change any data
+    (("POST",), re.compile(r"^api/users/(login|logout)/?$"), ()),
+    (("POST",), re.compile(r"^api/users/register/?$"), ("users",)),
+    (("POST", "DELETE"), re.compile(r"^api/users/follow/\d+/?$"), ("follows", "users")),
+    # deleting an account removes its tweets and follows as well
+    (("DELETE",), re.compile(r"^api/users/\d+/?$"), ("users", "tweets", "follows")),
+    # likes are the most frequent write and evict nothing: the like counts in cached lists
+    # may be up to one TTL old, like the counts the backend adds up in batches, and the
+    # like response itself carries the fresh count the frontend shows
+    (("POST", "DELETE"), re.compile(r"^api/tweets/\d+/like/?$"), ()),
+    # creating, editing and deleting tweets
+    (("POST", "PUT", "PATCH", "DELETE"), re.compile(r"^api/tweets(/.*)?$"), ("tweets",)),
+]
+
+# tag used for GETs that don't match any rule, so an unknown write can still evict them
+DEFAULT_TAG = "other"
+
+def read_tags(path):
+    """Tags to store a cached GET response under"""
+    path = path.lstrip("/")
+    for pattern, tags in READ_RULES:
+        if pattern.match(path):
+            return tags
+    return (DEFAULT_TAG,)
+
+def write_tags(method, path):
+    """
+    Tags a write invalidates, or None if the write is unknown and the whole cache
+    should be cleared to be safe
+    """
+    path = path.lstrip("/")
+    for methods, pattern, tags in WRITE_RULES:
+        if method in methods and pattern.match(path):
+            return tags
+    return None
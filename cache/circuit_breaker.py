@@ -0,0 +1,52 @@
+import time
+
+class CircuitBreaker:
+    """
+    Simple circuit breaker around the backend.
+
+    - closed: requests go through, consecutive failures are counted
+    - open: after failure_threshold failures in a row no request is sent for
+      reset_timeout seconds, callers fail fast (or serve stale data) instead of
+      piling up on a backend that is down or restarting
+    - half-open: after reset_timeout one trial request is let through, success closes
+      the circuit again and failure opens it for another reset_timeout
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+
+    def allow_request(self):
+        """True if a request may be sent to the backend right now"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_running = False
+
+    def release_trial(self):
+        """The trial ended without an answer from the backend (cancelled, local error), let the next one through"""
+        self._trial_running = False
+
+    def record_failure(self):
+        self._trial_running = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
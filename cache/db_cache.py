@@ -1,31 +1,188 @@
-from datetime import datetime, timedelta
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
 
-# Our cache is just a dictionary (similar to a JavaScript object)
-cache = {}
+# how many results the API keeps in memory, and for how long by default
+DB_CACHE_MAX_ENTRIES = int(os.getenv("DB_CACHE_MAX_ENTRIES", "5000"))
+DB_CACHE_TTL_SECONDS = float(os.getenv("DB_CACHE_TTL_SECONDS", "60"))
+
+class TTLCache:
+    """
+    In-process cache for database reads, between the API and the database.
+
+    - every key has its own expiry time (default_ttl unless a ttl is given)
+    - at most max_entries keys, the least recently used one is evicted first
+    - time.monotonic() so a clock change can't expire (or keep) everything at once
+    - one lock around every operation, FastAPI runs the sync controllers in a threadpool
+    - hit/miss/eviction counters for the /logs endpoint
+    - every key can carry tags ("tweets", "user:5"...), a write calls invalidate() with the
+      tags it makes stale and exactly the keys carrying them are removed
+    """
+
+    def __init__(self, max_entries, default_ttl):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # {key: (expires_at, value, tags)} in least-recently-used order
+        self._entries = OrderedDict()
+        # {tag: set of keys}
+        self._tag_index = {}
+        # bumped on every invalidate(), {tag: generation it was last invalidated at}
+        # lets a read that started before a write notice it and not store its result
+        self._generation = 0
+        self._tag_invalidated_at = {}
+        # _tag_invalidated_at is reset when it gets big, reads older than that can't be checked
+        self._floor = 0
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        """Return the cached value for key, or None if it is missing or expired"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value, _ = item
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self):
+        """Current invalidation generation, pass it to set(since=...) for results read from the database"""
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, ttl=None, tags=(), since=None):
+        """
+        Store value under key for ttl seconds (default_ttl if not given).
+        If since is given and one of the tags was invalidated after that generation,
+        the value was read before a write that made it stale and is not stored
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        tags = tuple(tags)
+        with self._lock:
+            if since is not None and (
+                since < self._floor or any(self._tag_invalidated_at.get(tag, 0) > since for tag in tags)
+            ):
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value, tags)
+            for tag in tags:
+                self._tag_index.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                return True
+            return False
+
+    def invalidate(self, *tags):
+        """Remove every key carrying one of the tags, returns how many were removed"""
+        removed = 0
+        with self._lock:
+            self._generation += 1
+            if len(self._tag_invalidated_at) > 10 * self.max_entries:
+                self._tag_invalidated_at.clear()
+                self._floor = self._generation
+            for tag in tags:
+                self._tag_invalidated_at[tag] = self._generation
+                for key in list(self._tag_index.get(tag, ())):
+                    self._remove(key)
+                    removed += 1
+            self.invalidations += removed
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tag_index.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def cached(self, key_template, ttl=None, tags=()):
+        """
+        Decorator that caches what a function returns.
+
+        key_template and every tag are formatted with the function's arguments by name, e.g.
+            @db_cache.cached("user_tweets_{user_id}", tags=["tweets_of:{user_id}"])
+            def get_tweets_by_user(user_id: int, db: Session): ...
+        A tag can also be a function that gets the result and returns more tags, for
+        results whose dependencies are only known after the query.
+        Exceptions (like a 404 HTTPException) are not cached.
+        """
+        def decorator(func):
+            signature = inspect.signature(func)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                key = key_template.format(**bound.arguments)
+
+                result = self.get(key)
+                if result is not None:
+                    return result
+                since = self.generation()
+                result = func(*args, **kwargs)
+
+                result_tags = []
+                for tag in tags:
+                    if callable(tag):
+                        result_tags.extend(tag(result))
+                    else:
+                        result_tags.append(tag.format(**bound.arguments))
+                self.set(key, result, ttl, tags=result_tags, since=since)
+                return result
+
+            return wrapper
+        return decorator
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+
+# the cache shared by all controllers
+db_cache = TTLCache(max_entries=DB_CACHE_MAX_ENTRIES, default_ttl=DB_CACHE_TTL_SECONDS)
+
+cached = db_cache.cached
+invalidate = db_cache.invalidate
 
 def get_from_cache(key):
     """Try to get something from cache"""
-    # If the key exists in our cache
-    if key in cache:
-        entry = cache[key]
-        now = datetime.now()
-        
-        # Check if it's less than 1 minute old
-        if now - entry["timestamp"] < timedelta(minutes=1):
-            print(f"DB Cache: Found {key} in cache!")
-            return entry["data"]
-        else:
-            # It's too old, delete it
-            print(f"DB Cache: {key} expired, removing")
-            del cache[key]
-    
-    # Not in cache or expired
-    return None
-
-def save_to_cache(key, data):
+    return db_cache.get(key)
+
+def save_to_cache(key, data, ttl=None, tags=()):
     """Save something to the cache"""
-    cache[key] = {
-        "data": data,
-        "timestamp": datetime.now()
-    }
-    print(f"DB Cache: Saved {key} to cache")
\ No newline at end of file
+    db_cache.set(key, data, ttl, tags)
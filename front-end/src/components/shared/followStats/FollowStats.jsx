@@ -1,7 +1,7 @@
 import { useState, useEffect} from 'react';
 import PropTypes from 'prop-types';
 import Button from "../../ui/Button.jsx"
-import { getFollowersCount, getFollowingCount, getFollowing, followUser, unfollowUser } from '../../../service/userService.js';
+import { getFollowersCount, getFollowingCount, getFollowingStatus, followUser, unfollowUser } from '../../../service/userService.js';
 
 // This component displays follower/following counts and a follow/unfollow button
 // It receives three props:
@@ -59,12 +59,9 @@ const FollowStats = ({ userId, styles, onFollowStatusChange}) => {
                     console.log("No token available, skipping follow status check");
                     return;
                 }
-                // Get list of users that the current user is following
-                const data = await getFollowing();
-                const followingList = data.following || [];
-
-                // Check if this profile's userId exists in the list of followed users
-                const isFollowingUser = followingList.some(user => user.id === userId);
+                // Ask the backend if the current user follows this profile
+                const data = await getFollowingStatus([userId]);
+                const isFollowingUser = (data.following || []).includes(userId);
                 setIsFollowing(isFollowingUser);
 
                 // then notify parent component (i htink the profile.jsx) of follow status
@@ -2,7 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
 import Button from "../../ui/Button.jsx";
 import styles from './ListUsers.module.css';
-import { getFollowing, followUser, unfollowUser } from '../../../service/userService.js';
+import { getFollowingStatus, followUser, unfollowUser } from '../../../service/userService.js';
 
 const ListUsers = () => {
   const [users, setUsers] = useState([]);
@@ -43,7 +43,7 @@ const ListUsers = () => {
     fetchUsers();
   }, []);
 
-  // Fetch the list of users the current user is following in a separate useEffect
+  // Check which of the listed users the current user is following, once the users are loaded
   useEffect(() => {
     const fetchFollowing = async () => {
       try {
@@ -55,10 +55,10 @@ const ListUsers = () => {
           return;
         }
 
-        const data = await getFollowing(); // this is coming form the userService
-        // Extract the followed user IDs
-        const followingIds = data.following.map(u => u.id);
-        setFollowing(followingIds);
+        // one request for the whole list, coming form the userService
+        // (the status endpoint takes at most 200 ids)
+        const data = await getFollowingStatus(users.slice(0, 200).map(u => u.id));
+        setFollowing(data.following);
       } catch (err) {
         console.error('Error fetching following:', err);
         // Don't set error - just log it, we'll show users anyway
@@ -68,7 +68,7 @@ const ListUsers = () => {
     };
 
     fetchFollowing();
-  }, []);
+  }, [users]);
 
   // Handle follow/unfollow button click
   const handleToggleFollow = async (userId) => {
@@ -2,7 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
 import styles from "./FollowersList.module.css";
 import Button from '../../ui/Button.jsx';
-import { getFollowing, followUser, unfollowUser } from '../../../service/userService.js';
+import { followUser, unfollowUser } from '../../../service/userService.js';
 
 const FollowersList = ({ type }) => {
   const [users, setUsers] = useState([]);
@@ -10,50 +10,56 @@ const FollowersList = ({ type }) => {
   const [error, setError] = useState('');
   const [following, setFollowing] = useState([]);
 
-  useEffect(() => {
-    const fetchUsers = async () => {
-      setLoading(true);
-      try {
-        const token = localStorage.getItem('token');
-        if (!token) {
-          setError('Authentication required');
-          setLoading(false);
-          return;
-        }
+  // cursor of the next page of users, null when there are no more
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  // Fetch one page of users, the first one when before is not given
+  const fetchPage = async (before) => {
+    const token = localStorage.getItem('token');
+    if (!token) {
+      throw new Error('Authentication required');
+    }
 
-        // Determine which endpoint to call based on the type prop
-        // const endpoint = type === 'followers' 
-        //   ? 'https://twitter-remake-backend.onrender.com/api/users/followers'
-        //   : 'https://twitter-remake-backend.onrender.com/api/users/following';
+    // Determine which endpoint to call based on the type prop
+    // const endpoint = type === 'followers' 
+    //   ? 'https://twitter-remake-backend.onrender.com/api/users/followers'
+    //   : 'https://twitter-remake-backend.onrender.com/api/users/following';
 
-        const endpoint = type === 'followers' 
-          ? 'http://localhost:8000/api/users/followers'
-          : 'http://localhost:8000/api/users/following';
+    const endpoint = type === 'followers' 
+      ? 'http://localhost:8000/api/users/followers'
+      : 'http://localhost:8000/api/users/following';
 
-        const response = await fetch(endpoint, {
-          headers: {
-            'Authorization': `Bearer ${token}`,
-            'Content-Type': 'application/json'
-          }
-        });
+    const url = before ? `${endpoint}?before=${encodeURIComponent(before)}` : endpoint;
+    const response = await fetch(url, {
+      headers: {
+        'Authorization': `Bearer ${token}`,
+        'Content-Type': 'application/json'
+      }
+    });
 
-        if (!response.ok) {
-          throw new Error(`Failed to fetch ${type}`);
-        }
+    if (!response.ok) {
+      throw new Error(`Failed to fetch ${type}`);
+    }
 
-        const data = await response.json();
-        setUsers(data[type] || []);
-
-        // If we're showing followers, we need to know which ones we're already following
-        if (type === 'followers') {
-          const followingData = await getFollowing();
-          const followingIds = followingData.following.map(user => user.id);
-          setFollowing(followingIds);
-        } else {
-          // If showing following, mark all as followed already
-          setFollowing(data.following.map(user => user.id));
-        }
+    return await response.json();
+  };
 
+  // Both lists say for every user whether we follow them (is_following)
+  const addPage = (data) => {
+    const pageUsers = data[type] || [];
+    setUsers(prev => [...prev, ...pageUsers]);
+    setFollowing(prev => [...prev, ...pageUsers.filter(user => user.is_following).map(user => user.id)]);
+    setNextCursor(data.next_cursor || null);
+  };
+
+  useEffect(() => {
+    const fetchUsers = async () => {
+      setLoading(true);
+      setUsers([]);
+      setFollowing([]);
+      try {
+        addPage(await fetchPage());
       } catch (err) {
         console.error(`Error fetching ${type}:`, err);
         setError(err.message || 'Something went wrong');
@@ -65,6 +71,19 @@ const FollowersList = ({ type }) => {
     fetchUsers();
   }, [type]);
 
+  // Add the next page of users below the ones already shown
+  const loadMoreUsers = async () => {
+    setLoadingMore(true);
+    try {
+      addPage(await fetchPage(nextCursor));
+    } catch (err) {
+      console.error(`Error fetching more ${type}:`, err);
+      setError(err.message || 'Something went wrong');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleToggleFollow = async (userId) => {
     const token = localStorage.getItem('token');
     if (!token) {
@@ -157,6 +176,14 @@ const FollowersList = ({ type }) => {
           ))}
         </ul>
       )}
+
+      {nextCursor && (
+        <div className={styles.loadMore}>
+          <Button variant="outline" onClick={loadMoreUsers} disabled={loadingMore}>
+            {loadingMore ? "Loading..." : "Load more"}
+          </Button>
+        </div>
+      )}
     </div>
   );
 };
@@ -3,12 +3,16 @@ import styles from "./HomePage.module.css";
 import PostHome from "../../components/shared/postContainers/PostHome";
 import SearchBar from "../../components/shared/searchBar/SearchBar";
 import TweetList from "../../components/shared/tweets/TweetList";
+import Button from "../../components/ui/Button";
 import { getAllTweets } from "../../service/tweetService";
 
 function HomePage() {
   const [tweets, setTweets] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState("");
+  // cursor of the next page of tweets, null when there are no more
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   // Fetch tweets on component mount
   useEffect(() => {
@@ -20,7 +24,8 @@ function HomePage() {
     setLoading(true);
     try {
       const data = await getAllTweets();
-      setTweets(data);
+      setTweets(data.tweets);
+      setNextCursor(data.nextCursor);
       setError("");
     } catch (err) {
       console.error("Error fetching tweets:", err);
@@ -30,6 +35,21 @@ function HomePage() {
     }
   };
 
+  // Function to add the next page of tweets below the ones already shown
+  const loadMoreTweets = async () => {
+    setLoadingMore(true);
+    try {
+      const data = await getAllTweets(nextCursor);
+      setTweets(prevTweets => [...prevTweets, ...data.tweets]);
+      setNextCursor(data.nextCursor);
+    } catch (err) {
+      console.error("Error fetching more tweets:", err);
+      setError("Failed to load tweets. Please try again later.");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // Function to handle when a new tweet is created
   const handleTweetCreated = (newTweet) => {
     setTweets(prevTweets => [newTweet, ...prevTweets]);
@@ -48,7 +68,16 @@ function HomePage() {
       ) : error ? (
         <div className={styles.errorState}>{error}</div>
       ) : (
-        <TweetList tweets={tweets} onTweetUpdated={fetchTweets} />
+        <>
+          <TweetList tweets={tweets} onTweetUpdated={fetchTweets} />
+          {nextCursor && (
+            <div className={styles.loadMore}>
+              <Button variant="outline" onClick={loadMoreTweets} disabled={loadingMore}>
+                {loadingMore ? "Loading..." : "Load more"}
+              </Button>
+            </div>
+          )}
+        </>
       )}
     </div>
   );
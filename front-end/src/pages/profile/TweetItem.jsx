@@ -3,7 +3,7 @@ import { IoIosMore } from "react-icons/io";
 import { GoHeart } from "react-icons/go";
 import styles from "./TweetItem.module.css";
 import { updateTweet, deleteTweet } from "../../service/tweetService";
-import { addLike } from "../../service/likeService";
+import { addLike, removeLike } from "../../service/likeService";
 import { useAuth } from "../../contexts/AuthContext";
 import Button from "../../components/ui/Button.jsx";
 
@@ -24,6 +24,7 @@ const TweetItem = ({ tweet, onTweetUpdated, onTweetDeleted }) => {
   const [error, setError] = useState("");
   const [isOwnTweet, setIsOwnTweet] = useState(false);
   const [likes, setLikes] = useState(tweet.likes || 0);
+  const [liked, setLiked] = useState(tweet.liked_by_me || false);
 
   // Format date for display
   const formatDate = (dateString) => {
@@ -107,9 +108,10 @@ const TweetItem = ({ tweet, onTweetUpdated, onTweetDeleted }) => {
 
   const handleLike = async () => {
     try {
-      // call service, get new total
-      const newCount = await addLike(tweet.id);
+      // call service, get new total; a second click takes the like back
+      const newCount = liked ? await removeLike(tweet.id) : await addLike(tweet.id);
       setLikes(newCount);
+      setLiked(!liked);
     } catch (err) {
       console.error("Error liking tweet:", err);
   }
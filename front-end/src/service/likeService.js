@@ -1,13 +1,59 @@
 // const API_URL = 'https://twitter-remake-backend.onrender.com/api';
 const API_URL = 'http://localhost:8000/api';
 
+// likes are per user, so both calls need the token
+const getAuthHeaders = () => ({
+    'Authorization': `Bearer ${localStorage.getItem('token')}`
+});
+
 export const addLike = async (tweetId) => {
     const res = await fetch(`${API_URL}/tweets/${tweetId}/like`, {
-        method: 'POST'
+        method: 'POST',
+        headers: getAuthHeaders()
     });
     if (!res.ok) {
         throw new Error('Failed to like tweet');
     }
     const { cached } = await res.json();
     return cached;
-};
\ No newline at end of file
+};
+
+// Sets liked_by_me on a list of tweets with one request for the whole list.
+// The lists themselves are read without a token so the cache servers can share them
+// between users, only this small personal lookup goes to the backend
+export const withLikedByMe = async (tweets) => {
+    const token = localStorage.getItem('token');
+    const ids = tweets.map(tweet => tweet.id);
+    if (!token || ids.length === 0) {
+        return tweets;
+    }
+    try {
+        const liked = new Set();
+        // the endpoint takes at most 200 ids
+        for (let start = 0; start < ids.length; start += 200) {
+            const res = await fetch(`${API_URL}/tweets/liked?ids=${ids.slice(start, start + 200).join(',')}`, {
+                headers: getAuthHeaders()
+            });
+            if (!res.ok) {
+                throw new Error('Failed to fetch liked tweets');
+            }
+            (await res.json()).liked.forEach(id => liked.add(id));
+        }
+        return tweets.map(tweet => ({ ...tweet, liked_by_me: liked.has(tweet.id) }));
+    } catch (error) {
+        console.error('Error fetching liked tweets:', error);
+        return tweets;
+    }
+};
+
+export const removeLike = async (tweetId) => {
+    const res = await fetch(`${API_URL}/tweets/${tweetId}/like`, {
+        method: 'DELETE',
+        headers: getAuthHeaders()
+    });
+    if (!res.ok) {
+        throw new Error('Failed to unlike tweet');
+    }
+    const { cached } = await res.json();
+    return cached;
+};
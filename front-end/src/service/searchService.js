@@ -3,23 +3,11 @@
  * All API calls related to search functionality are centralized here
  */
 
+import { getFollowingStatus } from './userService';
+
 // const API_URL = 'https://twitter-remake-backend.onrender.com/api';
 const API_URL = 'http://localhost/api';
 
-// Helper function to get auth headers
-const getAuthHeaders = () => {
-  const token = localStorage.getItem('token');
-  if (token) {
-    return {
-      'Authorization': `Bearer ${token}`,
-      'Content-Type': 'application/json'
-    };
-  }
-  return {
-    'Content-Type': 'application/json'
-  };
-};
-
 /**
  * Search for tweets
  * @param {string} query - Search query
@@ -78,17 +66,8 @@ export const searchUsers = async (query) => {
     // If we have a user and we're logged in, check if we're following them
     if (data.user && localStorage.getItem('token')) {
       try {
-        const followingData = await fetch(
-          `${API_URL}/users/following`,
-          {
-            headers: getAuthHeaders()
-          }
-        );
-        
-        if (followingData.ok) {
-          const followingList = await followingData.json();
-          data.user.is_following = followingList.following?.some(u => u.id === data.user.id) || false;
-        }
+        const followingData = await getFollowingStatus([data.user.id]);
+        data.user.is_following = followingData.following.includes(data.user.id);
       } catch (followError) {
         console.error('Error checking follow status:', followError);
         data.user.is_following = false;
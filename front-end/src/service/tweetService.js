@@ -3,6 +3,8 @@
  * All API calls related to tweets are centralized here
  */
 
+import { withLikedByMe } from './likeService';
+
 // const API_URL = 'https://twitter-remake-backend.onrender.com/api';
 const API_URL = 'http://localhost/api';
 
@@ -19,14 +21,18 @@ const getAuthHeaders = () => {
   };
 };
 
-// Get all tweets
-export const getAllTweets = async () => {
+// Get one page of tweets, newest first
+// before: the nextCursor of the previous page, leave it out for the first page
+// returns { tweets, nextCursor }, nextCursor is null on the last page
+export const getAllTweets = async (before = null) => {
   try {
-    const response = await fetch(`${API_URL}/tweets`);
+    const query = before ? `?before=${encodeURIComponent(before)}` : '';
+    const response = await fetch(`${API_URL}/tweets${query}`);
     if (!response.ok) {
       throw new Error('Failed to fetch tweets');
     }
-    return await response.json();
+    const tweets = await withLikedByMe(await response.json());
+    return { tweets, nextCursor: response.headers.get('X-Next-Cursor') };
   } catch (error) {
     console.error('Error fetching tweets:', error);
     throw error;
@@ -40,7 +46,8 @@ export const getUserTweets = async (userId) => {
     if (!response.ok) {
       throw new Error('Failed to fetch user tweets');
     }
-    return await response.json();
+    const data = await response.json();
+    return { ...data, tweets: await withLikedByMe(data.tweets) };
   } catch (error) {
     console.error('Error fetching user tweets:', error);
     throw error;
@@ -1,3 +1,5 @@
+import { withLikedByMe } from './likeService';
+
 // const API_URL = 'https://twitter-remake-backend.onrender.com/api';
 const API_URL = 'http://localhost/api';
 
@@ -63,7 +65,8 @@ export const getUserTweets = async (userId) => {
   try {
     const response = await fetch(`${API_URL}/users/${userId}/tweets`);
     if (!response.ok) throw new Error("Failed to fetch user tweets");
-    return await response.json();
+    const data = await response.json();
+    return { ...data, tweets: await withLikedByMe(data.tweets) };
   } catch (error) {
     console.error("Error fetching user tweets:", error);
     throw error;
@@ -128,6 +131,34 @@ export const getFollowing = async () => {
   }
 };
 
+// Which of the given users the current user follows, returns { following: [ids] }
+// (the following list is paginated, so scanning it only sees the first page)
+export const getFollowingStatus = async (userIds) => {
+  try {
+    const token = localStorage.getItem('token');
+    if (!token || userIds.length === 0) {
+      return { following: [] };
+    }
+
+    const response = await fetch(`${API_URL}/users/following/status?ids=${userIds.join(',')}`, {
+      headers: {
+        'Authorization': `Bearer ${token}`,
+        'Content-Type': 'application/json'
+      }
+    });
+
+    if (!response.ok) {
+      console.warn(`Failed to fetch following status: ${response.status}`);
+      return { following: [] };
+    }
+
+    return await response.json();
+  } catch (error) {
+    console.error('Error fetching following status:', error);
+    return { following: [] };
+  }
+};
+
 // Get users following the current user
 export const getFollowers = async () => {
   try {